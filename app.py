@@ -1,16 +1,36 @@
 
 # importando as bibliotecas necessarias 
 
-from flask import Flask, render_template, request, send_file, jsonify, url_for
+import time
+IMPORT_STARTED = time.perf_counter()  # início do import, para startup_times
+
+from flask import (Flask, render_template, request, send_file, jsonify, url_for, Response, stream_with_context,
+                   g, has_request_context)
 import os
 import ssl
 import requests
 import re
 import uuid
-import time
 import threading
+import warnings
+import sqlite3
+import functools
+import contextlib
+import copy
+import bisect
+import itertools
+import json
+import hashlib
+import shutil
+import random
+import subprocess
+from collections import OrderedDict
+from urllib.parse import urlparse, quote
+from concurrent.futures import ThreadPoolExecutor, Future, TimeoutError as FutureTimeoutError
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from dotenv import load_dotenv
-import yt_dlp
+from youtube_url import parse_youtube_url
 
 # ======================================================================
 
@@ -18,13 +38,6 @@ import yt_dlp
 
 load_dotenv() 
 
-# ======================================================================
-
-
-# Adicionar tratamento para erros SSL
-
-ssl._create_default_https_context = ssl._create_unverified_context
-
 # =========================================================================
 
 app = Flask(__name__)
@@ -33,12 +46,1560 @@ app = Flask(__name__)
 DOWNLOAD_FOLDER = 'downloads'
 ALLOWED_EXTENSIONS = {'mp4'}
 YOUTUBE_API_KEY = os.getenv('YOUTUBE_API_KEY') 
+YOUTUBE_CHANNELS_URL = os.getenv('YOUTUBE_CHANNELS_URL', 'https://www.googleapis.com/youtube/v3/channels')
+CHANNEL_CACHE_TTL = int(os.getenv('CHANNEL_CACHE_TTL', 10 * 60))
+CHANNEL_BATCH_WINDOW = float(os.getenv('CHANNEL_BATCH_WINDOW', 0.02))
+MAX_CONCURRENT_DOWNLOADS = int(os.getenv('MAX_CONCURRENT_DOWNLOADS', 3))
+MAX_DOWNLOADS_PER_HOST = int(os.getenv('MAX_DOWNLOADS_PER_HOST', 2))
+MAX_QUEUED_DOWNLOADS = int(os.getenv('MAX_QUEUED_DOWNLOADS', 100))
+MAX_BATCH_ITEMS = int(os.getenv('MAX_BATCH_ITEMS', 200))
+MAX_CONCURRENT_BATCHES = int(os.getenv('MAX_CONCURRENT_BATCHES', 2))
+CACHE_MAX_BYTES = int(os.getenv('CACHE_MAX_BYTES', 5 * 1024 * 1024 * 1024))
+CACHE_TTL = int(os.getenv('CACHE_TTL', 24 * 60 * 60))
+CACHE_INDEX_FILE = os.path.join(DOWNLOAD_FOLDER, '.cache_index.json')
+STORAGE_MAX_BYTES = int(os.getenv('STORAGE_MAX_BYTES', 10 * 1024 * 1024 * 1024))  # cota total do DOWNLOAD_FOLDER
+STORAGE_ORPHAN_TTL = int(os.getenv('STORAGE_ORPHAN_TTL', 6 * 60 * 60))  # janela para retomar .part
+STORAGE_JANITOR_INTERVAL = int(os.getenv('STORAGE_JANITOR_INTERVAL', 60))
+STORAGE_SWEEP_BATCH = 500  # arquivos verificados por rodada do janitor
+DEFAULT_FORMAT = 'best[ext=mp4]'
+INFO_CACHE_TTL = int(os.getenv('INFO_CACHE_TTL', 30 * 60))
+INFO_CACHE_MAX_BYTES = int(os.getenv('INFO_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+INFO_CACHE_DIR = os.getenv('INFO_CACHE_DIR')  # opcional: persiste as informações em disco
+DOWNLOAD_SEGMENTS = int(os.getenv('DOWNLOAD_SEGMENTS', 4))
+DOWNLOAD_CHUNK_SIZE = int(os.getenv('DOWNLOAD_CHUNK_SIZE', 256 * 1024))
+SEGMENT_RETRIES = int(os.getenv('SEGMENT_RETRIES', 3))
+MIN_SEGMENT_SIZE = 1024 * 1024  # arquivos menores não são divididos
+PROGRESS_STREAM_INTERVAL = float(os.getenv('PROGRESS_STREAM_INTERVAL', 0.25))  # até 4 eventos/s
+PROGRESS_KEEPALIVE = 15
+# Cada SSE ocupa uma thread do servidor WSGI (o asgi.py não tem esse limite)
+MAX_PROGRESS_STREAMS = int(os.getenv('MAX_PROGRESS_STREAMS', 4))
+PROGRESS_BACKEND = os.getenv('PROGRESS_BACKEND', 'memory')  # ou sqlite:///caminho/progress.db
+PROGRESS_MAX_RATE = float(os.getenv('PROGRESS_MAX_RATE', 4))  # gravações por segundo por download
+PROGRESS_TTL = int(os.getenv('PROGRESS_TTL', 60 * 60))
+PROGRESS_IDLE_TTL = int(os.getenv('PROGRESS_IDLE_TTL', 6 * 60 * 60))
+FILE_SERVING_MODE = os.getenv('FILE_SERVING_MODE', 'direct')  # direct, x-sendfile ou x-accel
+X_ACCEL_PREFIX = os.getenv('X_ACCEL_PREFIX', '/protected-downloads/')
+FILE_MAX_AGE = int(os.getenv('FILE_MAX_AGE', 3600))
+TIMING_SPANS = os.getenv('TIMING_SPANS', '0') == '1'  # spans nos caminhos críticos (Server-Timing)
+YDL_POOL_SIZE = int(os.getenv('YDL_POOL_SIZE', 4))  # instâncias ociosas do YoutubeDL por perfil
+YDL_POOL_MAX_USES = int(os.getenv('YDL_POOL_MAX_USES', 100))
+MAX_DOWNLOAD_ATTEMPTS = int(os.getenv('MAX_DOWNLOAD_ATTEMPTS', 4))  # tentativas por download, entre todos os métodos
+BREAKER_THRESHOLD = int(os.getenv('BREAKER_THRESHOLD', 5))  # falhas seguidas que abrem o circuito de um método
+BREAKER_COOLDOWN = int(os.getenv('BREAKER_COOLDOWN', 60))
+BREAKER_MAX_COOLDOWN = int(os.getenv('BREAKER_MAX_COOLDOWN', 10 * 60))
+FFMPEG_PATH = os.getenv('FFMPEG_PATH') or shutil.which('ffmpeg')  # sem ffmpeg não há conversão nem merge
+POSTPROCESS_WORKERS = int(os.getenv('POSTPROCESS_WORKERS', 2))  # processos ffmpeg simultâneos
+BANDWIDTH_MAX_RATE = int(os.getenv('BANDWIDTH_MAX_RATE', 0))  # bytes/s de entrada somando todos os downloads (0 = sem limite)
+BANDWIDTH_FILE_RESERVE = float(os.getenv('BANDWIDTH_FILE_RESERVE', 0.2))  # fração deixada livre enquanto /file envia arquivos
+DEFAULT_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+}
 
 # Ensure download directory exists
 os.makedirs(DOWNLOAD_FOLDER, exist_ok=True)
 
-# Dicionário para armazenar informações de progresso
-download_progress = {}
+# X-Sendfile (Apache/lighttpd): o Flask envia apenas o cabeçalho com o caminho
+app.config['USE_X_SENDFILE'] = FILE_SERVING_MODE == 'x-sendfile'
+
+# ======================================================================
+
+# Métricas no formato texto do Prometheus (/metrics)
+
+class Counter:
+    """Monotonic counter, optionally split by label values"""
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, label_values, value) for label_values, value in self._values.items()]
+
+class Histogram:
+    """Cumulative-bucket histogram (count, sum and le buckets per label set)"""
+
+    def __init__(self, name, help_text, buckets, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self._values = {}  # valores dos labels -> [contagens por bucket, soma, total]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(label_values)
+            if entry is None:
+                entry = self._values[label_values] = [[0] * len(self.buckets), 0.0, 0]
+            if index < len(self.buckets):
+                entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for label_values, (counts, total, count) in self._values.items():
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    samples.append((self.name + '_bucket', label_values + (repr(float(bound)),), cumulative))
+                samples.append((self.name + '_bucket', label_values + ('+Inf',), count))
+                samples.append((self.name + '_sum', label_values, total))
+                samples.append((self.name + '_count', label_values, count))
+        return samples
+
+class RateMeter:
+    """Events per second over a sliding window of whole seconds"""
+
+    def __init__(self, window=10):
+        self.window = window
+        self._buckets = {}  # segundo -> quantidade
+        self._lock = threading.Lock()
+
+    def add(self, amount):
+        second = int(time.monotonic())
+        with self._lock:
+            self._buckets[second] = self._buckets.get(second, 0) + amount
+            if len(self._buckets) > self.window + 1:
+                for old in [s for s in self._buckets if s <= second - self.window]:
+                    del self._buckets[old]
+
+    def rate(self):
+        # O segundo atual está incompleto e fica de fora da média
+        second = int(time.monotonic())
+        with self._lock:
+            total = sum(amount for s, amount in self._buckets.items() if second - self.window <= s < second)
+        return total / self.window
+
+class MetricsRegistry:
+    """Collects counters, histograms and gauges and renders the exposition text.
+
+    Gauges are callbacks evaluated only when /metrics is scraped, so the hot
+    paths pay for a dict update under a lock and nothing else.
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._gauges = []
+
+    def counter(self, name, help_text, labels=()):
+        metric = Counter(name, help_text, labels)
+        self._metrics.append(('counter', metric))
+        return metric
+
+    def histogram(self, name, help_text, buckets, labels=()):
+        metric = Histogram(name, help_text, buckets, labels)
+        self._metrics.append(('histogram', metric))
+        return metric
+
+    def gauge(self, name, help_text, func, kind='gauge', labels=()):
+        # kind='counter' para totais mantidos por outros objetos (ex.: InfoCache.hits)
+        # Com labels, func devolve {(valor, ...): amostra}
+        self._gauges.append((name, help_text, func, kind, labels))
+
+    def render(self):
+        lines = []
+        for kind, metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {kind}")
+            for name, label_values, value in metric.samples():
+                label_names = metric.labels + ('le',) * (len(label_values) - len(metric.labels))
+                lines.append(name + format_labels(label_names, label_values) + f" {value}")
+        for name, help_text, func, kind, labels in self._gauges:
+            try:
+                value = func()
+            except Exception as e:
+                app.logger.error(f"Error collecting metric {name}: {str(e)}")
+                continue
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            if labels:
+                for label_values, sample in value.items():
+                    lines.append(name + format_labels(labels, label_values) + f" {sample}")
+            else:
+                lines.append(f"{name} {value}")
+        return '\n'.join(lines) + '\n'
+
+def format_labels(names, values):
+    if not names:
+        return ''
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+metrics = MetricsRegistry()
+DOWNLOADS_TOTAL = metrics.counter('ytdl_downloads_total', 'Downloads finished, by method and result',
+                                  ('method', 'result'))
+DOWNLOAD_RETRIES = metrics.counter('ytdl_download_retries_total',
+                                   'Retried segments (requests) and download attempts, by method tried', ('method',))
+DOWNLOADED_BYTES = metrics.counter('ytdl_downloaded_bytes_total', 'Bytes fetched from the origin', ('method',))
+EXTRACT_INFO_SECONDS = metrics.histogram('ytdl_extract_info_seconds', 'Latency of yt-dlp extract_info calls',
+                                         (0.1, 0.25, 0.5, 1, 2, 5, 10, 30))
+PROGRESS_REQUESTS = metrics.counter('ytdl_progress_requests_total', 'Progress polls and SSE connections',
+                                    ('endpoint',))
+SPAN_SECONDS = metrics.histogram('ytdl_span_seconds', 'Duration of instrumented hot paths (TIMING_SPANS=1)',
+                                 (0.005, 0.025, 0.1, 0.5, 1, 5, 30, 120, 600), ('span',))
+POSTPROCESS_SECONDS = metrics.histogram('ytdl_postprocess_seconds', 'Duration of ffmpeg post-processing jobs',
+                                        (0.5, 1, 2, 5, 15, 60, 300, 1200), ('mode',))
+download_rate = RateMeter()
+
+def count_downloaded(method, size):
+    DOWNLOADED_BYTES.inc(method, amount=size)
+    download_rate.add(size)
+
+@contextlib.contextmanager
+def span(name):
+    """Time a block into ytdl_span_seconds and the Server-Timing header.
+
+    Does nothing unless TIMING_SPANS is enabled.
+    """
+    if not TIMING_SPANS:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(name, time.perf_counter() - started)
+
+def record_span(name, elapsed):
+    SPAN_SECONDS.observe(elapsed, name)
+    if has_request_context():
+        g.setdefault('spans', []).append((name, elapsed))
+
+@app.after_request
+def add_server_timing(response):
+    spans = g.get('spans')
+    if spans:
+        response.headers['Server-Timing'] = ', '.join(
+            f"{name.replace(' ', '_')};dur={elapsed * 1000:.1f}" for name, elapsed in spans)
+    return response
+
+# Tempos da inicialização deste processo, em segundos (import, yt-dlp, primeiro pedido)
+startup_times = {}
+
+@app.before_request
+def time_first_request():
+    if 'first_request' not in startup_times:
+        g.request_started = time.perf_counter()
+
+@app.after_request
+def record_first_request(response):
+    started = g.get('request_started')
+    if started is not None and 'first_request' not in startup_times:
+        now = time.perf_counter()
+        startup_times['first_request_latency'] = now - started
+        startup_times['first_request'] = now - IMPORT_STARTED
+        app.logger.info(f"First request served {startup_times['first_request']:.3f}s after import started "
+                        f"({startup_times['first_request_latency'] * 1000:.1f} ms): {startup_times}")
+    return response
+
+# ======================================================================
+
+# Armazenamento do progresso dos downloads
+
+FINISHED_STATUSES = ('completed', 'error')
+
+class MemoryProgressBackend:
+    """Progress entries kept in this process"""
+
+    shared = False
+
+    def __init__(self):
+        self._entries = {}
+
+    def get(self, download_id):
+        entry = self._entries.get(download_id)
+        return dict(entry) if entry is not None else None
+
+    def set(self, download_id, data):
+        self._entries[download_id] = data
+
+    def update(self, download_id, fields):
+        entry = self._entries.get(download_id)
+        if entry is not None:
+            entry.update(fields)
+
+    def delete(self, download_id):
+        self._entries.pop(download_id, None)
+
+    def expire(self, finished_before, idle_before):
+        for download_id, entry in list(self._entries.items()):
+            finished = entry.get('status') in FINISHED_STATUSES
+            if entry['_updated'] < (finished_before if finished else idle_before):
+                del self._entries[download_id]
+
+class SQLiteProgressBackend:
+    """Progress entries in a SQLite file shared by several worker processes"""
+
+    shared = True
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS progress '
+                         '(id TEXT PRIMARY KEY, data TEXT NOT NULL, updated REAL NOT NULL, finished INTEGER NOT NULL)')
+        # Com gunicorn --preload esta conexão seria herdada pelos workers: cada thread abre a sua
+        conn.close()
+        self._local.conn = None
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def get(self, download_id):
+        row = self._connection().execute('SELECT data FROM progress WHERE id = ?', (download_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, download_id, data):
+        self._connection().execute(
+            'INSERT OR REPLACE INTO progress (id, data, updated, finished) VALUES (?, ?, ?, ?)',
+            (download_id, json.dumps(data), data['_updated'], data.get('status') in FINISHED_STATUSES))
+
+    def update(self, download_id, fields):
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT data FROM progress WHERE id = ?', (download_id,)).fetchone()
+            if row:
+                data = json.loads(row[0])
+                data.update(fields)
+                conn.execute('UPDATE progress SET data = ?, updated = ?, finished = ? WHERE id = ?',
+                             (json.dumps(data), data['_updated'], data.get('status') in FINISHED_STATUSES,
+                              download_id))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def delete(self, download_id):
+        self._connection().execute('DELETE FROM progress WHERE id = ?', (download_id,))
+
+    def expire(self, finished_before, idle_before):
+        self._connection().execute(
+            'DELETE FROM progress WHERE (finished AND updated < ?) OR updated < ?',
+            (finished_before, idle_before))
+
+class ProgressStore:
+    """Thread-safe, throttled and expiring store of download progress.
+
+    Progress reporters skip writes while due() is False, which limits them
+    to max_rate per second per job; status changes are written right away.
+    Finished jobs expire after ttl seconds and jobs without updates after
+    idle_ttl seconds.
+    """
+
+    def __init__(self, backend, max_rate, ttl, idle_ttl):
+        self.backend = backend
+        self.interval = 1.0 / max_rate if max_rate > 0 else 0
+        self.ttl = ttl
+        self.idle_ttl = idle_ttl
+        self._lock = threading.Lock()
+        self._last_write = {}  # download_id -> monotonic da última escrita
+        self._waiters = {}
+        self._next_expire = 0
+
+    def create(self, download_id, data):
+        now = time.time()
+        if now >= self._next_expire:
+            self.expire()
+            self._next_expire = now + 60
+        with self._lock:
+            self.backend.set(download_id, dict(data, _updated=now))
+            self._last_write[download_id] = time.monotonic()
+
+    def get(self, download_id):
+        with self._lock:
+            data = self.backend.get(download_id)
+        if data is not None:
+            data.pop('_updated', None)
+        return data
+
+    def due(self, download_id):
+        """Whether a progress update for download_id is due (max_rate per second)"""
+        last = self._last_write.get(download_id)
+        return last is None or time.monotonic() - last >= self.interval
+
+    def update(self, download_id, fields):
+        """Merge fields into the entry"""
+        with self._lock:
+            self.backend.update(download_id, dict(fields, _updated=time.time()))
+            self._last_write[download_id] = time.monotonic()
+            cond = self._waiters.get(download_id)
+        if cond is not None:
+            with cond:
+                cond.notify_all()
+
+    def delete(self, download_id):
+        with self._lock:
+            self.backend.delete(download_id)
+            self._last_write.pop(download_id, None)
+            self._waiters.pop(download_id, None)
+
+    def condition(self, download_id):
+        """Condition notified on every write to download_id (this process only)"""
+        with self._lock:
+            return self._waiters.setdefault(download_id, threading.Condition())
+
+    def wait(self, cond, timeout):
+        # Com um backend compartilhado a escrita pode vir de outro processo
+        if self.backend.shared:
+            timeout = min(timeout, max(self.interval, PROGRESS_STREAM_INTERVAL))
+        return cond.wait(timeout)
+
+    def expire(self):
+        now = time.time()
+        with self._lock:
+            self.backend.expire(now - self.ttl, now - self.idle_ttl)
+            for download_id in list(self._last_write):
+                if self.backend.get(download_id) is None:
+                    del self._last_write[download_id]
+                    self._waiters.pop(download_id, None)
+
+def make_progress_backend(url):
+    if url.startswith('sqlite:///'):
+        return SQLiteProgressBackend(url[len('sqlite:///'):])
+    if url != 'memory':
+        raise ValueError(f"Backend de progresso desconhecido: {url}")
+    return MemoryProgressBackend()
+
+progress_store = ProgressStore(make_progress_backend(PROGRESS_BACKEND), PROGRESS_MAX_RATE,
+                               PROGRESS_TTL, PROGRESS_IDLE_TTL)
+progress_streams = threading.BoundedSemaphore(MAX_PROGRESS_STREAMS)
+
+# ======================================================================
+
+# Fila de downloads com um número fixo de workers
+
+class QueueFullError(Exception):
+    pass
+
+class DownloadScheduler:
+    """Fixed-size worker pool with a priority queue and per-host caps"""
+
+    def __init__(self, workers, per_host, max_queued):
+        self.workers = workers
+        self.per_host = per_host
+        self.max_queued = max_queued
+        self._pending = []  # ordenada por (prioridade, sequência)
+        self._active_hosts = {}
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._threads = []
+
+    def submit(self, download_id, func, args=(), host=None, priority=0):
+        """Queue a job and return its position (1 = next to run)"""
+        with self._cond:
+            if len(self._pending) >= self.max_queued:
+                raise QueueFullError('Fila de downloads cheia, tente novamente mais tarde')
+            job = (priority, next(self._seq), download_id, func, args, host)
+            bisect.insort(self._pending, job)  # a sequência é única, o resto nunca é comparado
+            self._start_workers()
+            self._cond.notify()
+            return self._pending.index(job) + 1
+
+    def position(self, download_id):
+        """Return the queue position of a pending job, or None"""
+        with self._cond:
+            for index, job in enumerate(self._pending):
+                if job[2] == download_id:
+                    return index + 1
+        return None
+
+    def stats(self):
+        with self._cond:
+            return {
+                'queued': len(self._pending),
+                'active': sum(self._active_hosts.values()),
+                'workers': self.workers
+            }
+
+    def _start_workers(self):
+        # Os workers só são criados no primeiro envio (evita threads duplicadas no reloader)
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._worker, daemon=True,
+                                      name=f'download-worker-{len(self._threads)}')
+            thread.start()
+            self._threads.append(thread)
+
+    def _next_job(self):
+        # Primeiro job (na ordem da fila) cujo host ainda não atingiu o limite
+        for index, job in enumerate(self._pending):
+            host = job[5]
+            if host is None or self._active_hosts.get(host, 0) < self.per_host:
+                return self._pending.pop(index)
+        return None
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                job = self._next_job()
+                while job is None:
+                    self._cond.wait()
+                    job = self._next_job()
+                host = job[5]
+                self._active_hosts[host] = self._active_hosts.get(host, 0) + 1
+
+            download_id, func, args = job[2], job[3], job[4]
+            try:
+                func(*args)
+            except Exception as e:
+                app.logger.error(f"Unhandled error in download job {download_id}: {str(e)}")
+            finally:
+                with self._cond:
+                    self._active_hosts[host] -= 1
+                    if not self._active_hosts[host]:
+                        del self._active_hosts[host]
+                    self._cond.notify_all()
+
+scheduler = DownloadScheduler(MAX_CONCURRENT_DOWNLOADS, MAX_DOWNLOADS_PER_HOST, MAX_QUEUED_DOWNLOADS)
+
+# Threads que expandem e alimentam os lotes (/batch) no scheduler
+batch_executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_BATCHES, thread_name_prefix='batch')
+
+# Pós-processamento (ffmpeg) fora do pool de downloads: cada thread acompanha um processo ffmpeg
+postprocess_executor = ThreadPoolExecutor(max_workers=POSTPROCESS_WORKERS, thread_name_prefix='postprocess')
+
+# Sessão compartilhada (keep-alive) para os downloads via requests
+download_session = requests.Session()
+download_session.verify = False  # Desativa verificação SSL
+download_session.mount("https://", HTTPAdapter(
+    pool_connections=MAX_CONCURRENT_DOWNLOADS,
+    pool_maxsize=MAX_CONCURRENT_DOWNLOADS * DOWNLOAD_SEGMENTS,
+    max_retries=Retry(total=5, backoff_factor=1, status_forcelist=[429, 500, 502, 503, 504],
+                      allowed_methods=["GET"])
+))
+download_session.mount("http://", download_session.get_adapter("https://"))
+
+# Suprimir avisos de SSL inseguro
+warnings.filterwarnings('ignore', message='Unverified HTTPS request')
+
+def url_host(url):
+    """Host used for per-host concurrency caps (www./m. prefixes ignored)"""
+    host = urlparse(url if '//' in url else '//' + url).hostname or ''
+    for prefix in ('www.', 'm.'):
+        if host.startswith(prefix):
+            host = host[len(prefix):]
+    return host
+
+def media_host(info, format_id=None):
+    """Host the media of a video is fetched from, when its info is cached.
+
+    Every page URL has the same host (youtube.com), so the per-host cap is
+    keyed on the format URL (googlevideo.com); jobs without cached info
+    are not capped.
+    """
+    if info is None:
+        return None
+    fmt = info.by_id.get(format_id.split('+')[0]) if format_id else info.select()
+    return url_host(fmt.url) if fmt is not None and fmt.url else None
+
+def parse_video_url(url):
+    """Return the YouTubeURL of a single-video URL, or None"""
+    parsed = parse_youtube_url(url)
+    return parsed if parsed and parsed.video_id else None
+
+# ======================================================================
+
+# Banda de entrada compartilhada entre os downloads (token bucket por job)
+
+class BandwidthJob:
+    __slots__ = ('weight', 'share', 'tokens', 'last', 'window_bytes', 'rate', 'params')
+    
+    def __init__(self, weight, now):
+        self.weight = weight
+        self.share = 0
+        self.tokens = 0
+        self.last = now
+        self.window_bytes = 0
+        self.rate = None  # bytes/s medidos; None até a primeira medição
+        self.params = None  # opções do YoutubeDL em uso, para ajustar o ratelimit
+
+class BandwidthManager:
+    """Splits a global ingress cap (bytes/s, 0 = unlimited) between jobs.
+    
+    Every interval the cap is divided by weight, max-min style: a job that
+    uses clearly less than its share (limited by the origin) keeps what it
+    uses plus some headroom and the rest goes to the others. Each job spends
+    its share through a token bucket; consume() sleeps when it runs ahead.
+    While files are being served, reserve of the cap is left unused.
+    """
+    
+    INTERVAL = 0.5
+    BURST = 0.5  # segundos de banda acumuláveis por job
+    HEADROOM = 1.25  # folga para um job limitado pela origem voltar a acelerar
+    MIN_SHARE = 16 * 1024
+    
+    def __init__(self, rate, reserve=0.0):
+        self.rate = rate
+        self.reserve = reserve
+        self._jobs = {}
+        self._allocated_at = time.monotonic()
+        self._serving_until = 0
+        self._lock = threading.Lock()
+    
+    def register(self, job_id, weight=1):
+        with self._lock:
+            self._jobs[job_id] = BandwidthJob(weight, time.monotonic())
+            self._allocate(time.monotonic())
+    
+    def unregister(self, job_id):
+        with self._lock:
+            if self._jobs.pop(job_id, None) is not None:
+                self._allocate(time.monotonic())
+    
+    def bind(self, job_id, params):
+        """Keep params['ratelimit'] (a YoutubeDL's options) at the job's
+        share; params=None releases them"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job.params = params
+                if self.rate and params is not None:
+                    params['ratelimit'] = int(job.share)
+    
+    def serving(self, size):
+        """A file of size bytes is being served: hold the reserve while it lasts"""
+        if not self.rate or not self.reserve:
+            return
+        with self._lock:
+            now = time.monotonic()
+            duration = min(60, size / (self.rate * self.reserve))
+            if now + duration > self._serving_until:
+                self._serving_until = now + duration
+                self._allocate(now)
+    
+    def consume(self, job_id, size):
+        """Account size bytes received by job_id, sleeping to stay within its share"""
+        delay = 0
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            now = time.monotonic()
+            job.window_bytes += size
+            if now - self._allocated_at >= self.INTERVAL:
+                self._allocate(now)
+            if self.rate:
+                job.tokens = min(job.share * self.BURST, job.tokens + (now - job.last) * job.share) - size
+                job.last = now
+                if job.tokens < 0:
+                    delay = -job.tokens / job.share
+        if delay:
+            time.sleep(delay)
+    
+    def _allocate(self, now):
+        elapsed = now - self._allocated_at
+        if elapsed >= self.INTERVAL:
+            for job in self._jobs.values():
+                measured = job.window_bytes / elapsed
+                job.rate = measured if job.rate is None else (job.rate + measured) / 2
+                job.window_bytes = 0
+            self._allocated_at = now
+        if not self.rate:
+            return
+        
+        remaining = self.rate * (1 - self.reserve if now < self._serving_until else 1)
+        pending = list(self._jobs.values())
+        while pending:
+            total_weight = sum(job.weight for job in pending)
+            limited = [job for job in pending if job.rate is not None
+                       and job.rate * self.HEADROOM < remaining * job.weight / total_weight]
+            if not limited:
+                break
+            for job in limited:
+                job.share = max(self.MIN_SHARE, job.rate * self.HEADROOM)
+                remaining -= job.share
+            pending = [job for job in pending if job not in limited]
+        if pending:
+            total_weight = sum(job.weight for job in pending)
+            for job in pending:
+                job.share = max(self.MIN_SHARE, remaining * job.weight / total_weight)
+        for job in self._jobs.values():
+            if job.params is not None:
+                job.params['ratelimit'] = int(job.share)
+    
+    def job_stats(self, job_id):
+        """(measured bytes/s, allocated bytes/s or None) of a job"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return 0, None
+            return job.rate or 0, job.share if self.rate else None
+    
+    def stats(self):
+        with self._lock:
+            return {'jobs': len(self._jobs), 'rate': sum(job.rate or 0 for job in self._jobs.values()),
+                    'serving': time.monotonic() < self._serving_until}
+
+bandwidth = BandwidthManager(BANDWIDTH_MAX_RATE, BANDWIDTH_FILE_RESERVE)
+
+def bandwidth_progress(job_id):
+    """Current speed and allocated share of a job, as /progress fields"""
+    rate, share = bandwidth.job_stats(job_id)
+    fields = {'speed': f"{rate / 1024 / 1024:.2f} MB/s"}
+    if share is not None:
+        fields['rate_limit'] = f"{share / 1024 / 1024:.2f} MB/s"
+    return fields
+
+# ======================================================================
+
+# Armazenamento do DOWNLOAD_FOLDER: índice em memória, cota e limpeza
+
+class StorageFullError(Exception):
+    def __init__(self, message='Espaço de armazenamento esgotado, tente novamente mais tarde'):
+        super().__init__(message)
+
+class StorageManager:
+    """In-memory index and byte quota for the files under root.
+
+    Downloads are written to shard subdirectories named after the first
+    characters of the video ID. Every file the app writes is registered
+    here, so sizes, lookups and quota checks never list a directory.
+    track() registers a file while a download is writing it, and commit()
+    marks it as kept by the download cache. Files that are neither
+    committed nor owned by a running download are orphans, and sweep()
+    deletes them once they are orphan_ttl seconds old. Until then a
+    .part file can still be resumed.
+    """
+
+    SHARD_CHARS = 2
+
+    def __init__(self, root, max_bytes, orphan_ttl, sweep_batch):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.orphan_ttl = orphan_ttl
+        self.sweep_batch = sweep_batch
+        self._files = {}  # caminho absoluto -> {'size', 'mtime', 'owner', 'stored'}
+        self._reserved = {}  # download_id -> bytes reservados
+        self._used = 0
+        self._shards = set()
+        self._protected = set()
+        self._sweep_queue = []
+        self._lock = threading.Lock()
+
+    def shard_dir(self, video_id):
+        path = os.path.join(self.root, (video_id or 'unknown')[:self.SHARD_CHARS])
+        if path not in self._shards:
+            os.makedirs(path, exist_ok=True)
+            self._shards.add(path)
+        return path
+
+    def protect(self, path):
+        """Never treat path (or files named like path + suffix) as an orphan"""
+        self._protected.add(os.path.abspath(path))
+
+    def track(self, path, owner):
+        """Register a file that download owner is writing"""
+        path = os.path.abspath(path)
+        with self._lock:
+            entry = self._files.get(path)
+            if entry is None:
+                self._files[path] = {'size': 0, 'mtime': time.time(), 'owner': owner, 'stored': False}
+            else:
+                entry['owner'] = owner
+
+    def commit(self, path):
+        """Register a finished file kept by the download cache"""
+        with self._lock:
+            self._refresh(os.path.abspath(path), owner=None, stored=True)
+
+    def uncommit(self, path):
+        """The cache dropped path without deleting it: it becomes an orphan"""
+        with self._lock:
+            entry = self._files.get(os.path.abspath(path))
+            if entry is not None:
+                entry['stored'] = False
+
+    def release(self, owner):
+        """A download finished: drop its reservation and update its files"""
+        with self._lock:
+            self._reserved.pop(owner, None)
+            for path, entry in list(self._files.items()):
+                if entry['owner'] == owner:
+                    self._refresh(path, owner=None)
+
+    def discard(self, path):
+        """Delete path and remove it from the index"""
+        path = os.path.abspath(path)
+        with self._lock:
+            self._drop(path)
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+    def exists(self, path):
+        return os.path.abspath(path) in self._files
+
+    def find(self, video_id, format_id, ext):
+        """Indexed file of video_id/format_id with extension ext (replaces listdir scans)"""
+        # Mesmo final de nome do outtmpl do yt-dlp e do direct_download_path
+        suffix = f"_{video_id}_{format_id}.{ext}"
+        with self._lock:
+            for path, entry in self._files.items():
+                if path.endswith(suffix) and entry['owner'] is None:
+                    return path
+        return None
+
+    def shortfall(self, size=0):
+        """Bytes missing to store size more bytes within the quota"""
+        with self._lock:
+            return self._used + sum(self._reserved.values()) + size - self.max_bytes
+
+    def reserve(self, owner, size):
+        """Reserve size bytes for a download or raise StorageFullError"""
+        with self._lock:
+            if self._used + sum(self._reserved.values()) + size > self.max_bytes:
+                raise StorageFullError()
+            self._reserved[owner] = size
+
+    def scan(self):
+        """Index files left by previous runs (root and shard directories)"""
+        found = 0
+        for directory in [self.root] + [entry.path for entry in os.scandir(self.root) if entry.is_dir()]:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.name.startswith('.') or not entry.is_file(follow_symlinks=False):
+                        continue
+                    path = os.path.abspath(entry.path)
+                    with self._lock:
+                        if path not in self._files:
+                            self._refresh(path)
+                            found += 1
+        return found
+
+    def sweep(self):
+        """Delete up to sweep_batch orphans; returns how many were deleted"""
+        now = time.time()
+        with self._lock:
+            if not self._sweep_queue:
+                self._sweep_queue = list(self._files)
+            batch = self._sweep_queue[-self.sweep_batch:]
+            del self._sweep_queue[-self.sweep_batch:]
+        
+        removed = 0
+        for path in batch:
+            with self._lock:
+                entry = self._files.get(path)
+                if (entry is None or entry['stored'] or entry['owner'] is not None
+                        or now - entry['mtime'] < self.orphan_ttl or self._is_protected(path)):
+                    continue
+                self._drop(path)
+            try:
+                os.unlink(path)
+                removed += 1
+                app.logger.info(f"Removed orphaned file {path}")
+            except OSError:
+                pass
+        return removed
+
+    def stats(self):
+        with self._lock:
+            return {
+                'used': self._used,
+                'reserved': sum(self._reserved.values()),
+                'max_bytes': self.max_bytes,
+                'files': len(self._files)
+            }
+
+    def _is_protected(self, path):
+        return any(path.startswith(protected) for protected in self._protected)
+
+    def _refresh(self, path, **fields):
+        # Chamado com o lock: relê tamanho/mtime do disco (remove do índice se não existe)
+        entry = self._files.get(path)
+        try:
+            st = os.stat(path)
+        except OSError:
+            self._drop(path)
+            return None
+        if entry is None:
+            entry = self._files[path] = {'size': 0, 'mtime': st.st_mtime, 'owner': None, 'stored': False}
+        self._used += st.st_size - entry['size']
+        entry['size'] = st.st_size
+        entry['mtime'] = st.st_mtime
+        entry.update(fields)
+        return entry
+
+    def _drop(self, path):
+        entry = self._files.pop(path, None)
+        if entry is not None:
+            self._used -= entry['size']
+
+storage = StorageManager(DOWNLOAD_FOLDER, STORAGE_MAX_BYTES, STORAGE_ORPHAN_TTL, STORAGE_SWEEP_BATCH)
+storage.protect(CACHE_INDEX_FILE)
+if isinstance(progress_store.backend, SQLiteProgressBackend):
+    storage.protect(progress_store.backend.path)  # inclui -wal e -shm
+
+# ======================================================================
+
+# Cache de arquivos baixados, indexado por (video_id, format_id)
+
+class DownloadCache:
+    """Persistent (video_id, format_id) -> file index with LRU/TTL eviction"""
+
+    def __init__(self, index_file, max_bytes, ttl, storage):
+        self.index_file = index_file
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.storage = storage
+        self._entries = OrderedDict()  # do menos para o mais recentemente usado
+        self._inflight = {}
+        self._tees = {}  # chave -> /stream gravando o arquivo no cache
+        self._dirty = False  # acessos ainda não gravados no índice
+        self._lock = threading.RLock()
+        self._load()
+
+    @staticmethod
+    def key(video_id, format_id, convert=None):
+        key = f"{video_id}:{format_id or DEFAULT_FORMAT}"
+        return f"{key}:{convert}" if convert else key
+
+    def _load(self):
+        try:
+            with open(self.index_file, encoding='utf-8') as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            return
+        for key, entry in sorted(entries.items(), key=lambda item: item[1].get('last_access', 0)):
+            self._entries[key] = entry
+            self.storage.commit(entry['filepath'])
+
+    def _save(self):
+        tmp_file = self.index_file + '.tmp'
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(self._entries, f)
+        os.replace(tmp_file, self.index_file)
+        self._dirty = False
+
+    def _is_valid(self, entry, now):
+        return now - entry['created'] <= self.ttl and os.path.isfile(entry['filepath'])
+
+    def get(self, key):
+        """Return the cached entry for key, or None on a miss"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            now = time.time()
+            if not self._is_valid(entry, now):
+                self._remove(key)
+                self._save()
+                return None
+            entry['last_access'] = now
+            self._entries.move_to_end(key)
+            # A ordem LRU só é gravada pelo janitor (prune) ou pelo próximo put/evict
+            self._dirty = True
+            return dict(entry)
+
+    def put(self, key, filepath, filename):
+        with self._lock:
+            now = time.time()
+            self._entries[key] = {
+                'filepath': filepath,
+                'filename': filename,
+                'size': os.path.getsize(filepath),
+                'created': now,
+                'last_access': now
+            }
+            self._entries.move_to_end(key)
+            self.storage.commit(filepath)
+            self._evict(keep=key)
+            self._save()
+
+    def claim(self, key, download_id):
+        """Register download_id as the in-flight download for key.
+
+        Returns the download_id already fetching this key, or None if the
+        caller became the owner of the download.
+        """
+        with self._lock:
+            leader = self._inflight.get(key)
+            if leader is not None:
+                return leader
+            self._inflight[key] = download_id
+            return None
+
+    def release(self, key, download_id):
+        with self._lock:
+            if self._inflight.get(key) == download_id:
+                del self._inflight[key]
+
+    def claim_tee(self, key, stream_id):
+        """Register stream_id as the /stream writing key to the cache.
+
+        Unlike claim(), a stream has no progress entry, so downloads never
+        follow it. Returns False while a download or another stream is
+        already fetching key.
+        """
+        with self._lock:
+            if key in self._inflight or key in self._tees:
+                return False
+            self._tees[key] = stream_id
+            return True
+
+    def release_tee(self, key, stream_id):
+        with self._lock:
+            if self._tees.get(key) == stream_id:
+                del self._tees[key]
+
+    def prune(self):
+        """Drop expired/missing entries, enforce the size budget and write
+        the index if anything (including access times) changed"""
+        with self._lock:
+            count = len(self._entries)
+            self._evict()
+            if self._dirty or len(self._entries) != count:
+                self._save()
+
+    def evict_bytes(self, size):
+        """Evict least recently used downloads until size bytes are freed"""
+        with self._lock:
+            freed = 0
+            for key in list(self._entries):
+                if freed >= size:
+                    break
+                freed += self._entries[key]['size']
+                app.logger.info(f"Evicting cached download {key} to free space")
+                self._remove(key, delete_file=True)
+            if freed:
+                self._save()
+            return freed
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': sum(entry['size'] for entry in self._entries.values()),
+                'inflight': len(self._inflight)
+            }
+
+    def _remove(self, key, delete_file=False):
+        entry = self._entries.pop(key)
+        if delete_file:
+            self.storage.discard(entry['filepath'])
+        else:
+            self.storage.uncommit(entry['filepath'])
+
+    def _evict(self, keep=None):
+        now = time.time()
+        for key, entry in list(self._entries.items()):
+            if key != keep and not self._is_valid(entry, now):
+                self._remove(key, delete_file=True)
+
+        total = sum(entry['size'] for entry in self._entries.values())
+        for key in list(self._entries):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            total -= self._entries[key]['size']
+            app.logger.info(f"Evicting cached download {key}")
+            self._remove(key, delete_file=True)
+
+download_cache = DownloadCache(CACHE_INDEX_FILE, CACHE_MAX_BYTES, CACHE_TTL, storage)
+
+def make_storage_room(size=0):
+    """Evict cached downloads so that size more bytes fit in the quota.
+
+    Returns whether they fit. Nothing is evicted when the whole cache would
+    not be enough.
+    """
+    shortfall = storage.shortfall(size)
+    if 0 < shortfall <= download_cache.stats()['bytes']:
+        download_cache.evict_bytes(shortfall)
+        shortfall = storage.shortfall(size)
+    return shortfall <= 0
+
+def admit_download(download_id, size):
+    """Reserve storage for a download or raise StorageFullError"""
+    make_storage_room(size)
+    storage.reserve(download_id, size)
+
+def run_janitor():
+    """Index leftovers, then periodically expire cache entries and orphans"""
+    try:
+        # Fora do caminho da inicialização: o servidor já atende enquanto isto roda
+        download_cache.prune()
+        found = storage.scan()
+        app.logger.info(f"Storage index ready ({found} unindexed files found)")
+    except Exception as e:
+        app.logger.error(f"Error scanning {DOWNLOAD_FOLDER}: {str(e)}")
+    while True:
+        time.sleep(STORAGE_JANITOR_INTERVAL)
+        try:
+            download_cache.prune()
+            if not make_storage_room():
+                app.logger.warning(f"Storage quota exceeded: {storage.stats()}")
+            storage.sweep()
+        except Exception as e:
+            app.logger.error(f"Storage janitor error: {str(e)}")
+
+def start_janitor():
+    threading.Thread(target=run_janitor, daemon=True, name='storage-janitor').start()
+
+# ======================================================================
+
+# Representação compacta das informações e formatos de um vídeo
+
+def format_filesize(filesize):
+    if filesize:
+        if filesize > 1024 * 1024 * 1024:  # GB
+            return f"{filesize / (1024 * 1024 * 1024):.1f} GB"
+        return f"{filesize / (1024 * 1024):.1f} MB"  # MB
+    return "Desconhecido"
+
+class VideoFormat:
+    """The few fields of a yt-dlp format we need to list and download it"""
+
+    # Os campos depois de downloader_options não são usados aqui, mas o yt-dlp
+    # precisa deles ao reprocessar o to_ie_result(): ordenação dos formatos
+    # (faixa original x dublada, formatos danificados), filtro de DRM e DASH
+    # fragmentado
+    __slots__ = ('format_id', 'ext', 'height', 'width', 'fps', 'vcodec', 'acodec',
+                 'filesize', 'tbr', 'protocol', 'url', 'manifest_url', 'http_headers',
+                 'downloader_options', 'quality', 'preference', 'source_preference',
+                 'language', 'language_preference', 'has_drm', 'fragments', 'fragment_base_url')
+
+    def __init__(self, *values):
+        # zip_longest: entradas do cache em disco gravadas com menos campos
+        for name, value in itertools.zip_longest(self.__slots__, values):
+            setattr(self, name, value)
+
+    @classmethod
+    def from_dict(cls, f, headers_pool):
+        values = [f.get(name) for name in cls.__slots__]
+        values[cls.__slots__.index('filesize')] = f.get('filesize') or f.get('filesize_approx')
+        # Os formatos de um vídeo normalmente compartilham os mesmos cabeçalhos
+        headers = f.get('http_headers')
+        if headers:
+            key = tuple(sorted(headers.items()))
+            values[cls.__slots__.index('http_headers')] = headers_pool.setdefault(key, headers)
+        return cls(*values)
+
+    @property
+    def has_video(self):
+        return bool(self.height) and self.vcodec != 'none'
+
+    @property
+    def has_audio(self):
+        return self.acodec not in (None, 'none')
+
+    def to_tuple(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def to_dict(self):
+        """Format dict in the shape yt-dlp expects"""
+        f = {name: getattr(self, name) for name in self.__slots__ if getattr(self, name) is not None}
+        if 'filesize' in f:
+            f['filesize_approx'] = f.pop('filesize')
+        return f
+
+class VideoInfo:
+    """Compact replacement for the yt-dlp info dict, indexed by height and ext"""
+
+    __slots__ = ('id', 'title', 'thumbnail', 'duration', 'webpage_url', 'extractor',
+                 'extractor_key', '_format_sort_fields', 'formats', 'by_id', 'by_height',
+                 'by_ext', 'listing')
+
+    FIELDS = __slots__[:8]
+
+    def __init__(self, fields, formats):
+        for name, value in itertools.zip_longest(self.FIELDS, fields):
+            setattr(self, name, value)
+        self.formats = tuple(formats)
+        self._index()
+
+    @classmethod
+    def from_info_dict(cls, info):
+        headers_pool = {}
+        raw_formats = info.get('formats') or ([info] if info.get('url') else [])
+        formats = [VideoFormat.from_dict(f, headers_pool) for f in raw_formats
+                   # Ignorar storyboards e outros formatos sem áudio nem vídeo
+                   if f.get('url') and (f.get('vcodec') != 'none' or f.get('acodec') != 'none')]
+        return cls([info.get(name) for name in cls.FIELDS], formats)
+
+    @classmethod
+    def from_json(cls, data):
+        return cls(data[0], [VideoFormat(*values) for values in data[1]])
+
+    def to_json(self):
+        return [[getattr(self, name) for name in self.FIELDS],
+                [f.to_tuple() for f in self.formats]]
+
+    def to_ie_result(self):
+        """Minimal info dict that yt-dlp can download without re-extracting"""
+        info = {name: getattr(self, name) for name in self.FIELDS if getattr(self, name) is not None}
+        info['formats'] = [f.to_dict() for f in self.formats]
+        return info
+
+    def _index(self):
+        self.by_id = {f.format_id: f for f in self.formats}
+        self.by_height = {}
+        self.by_ext = {}
+        for f in self.formats:
+            self.by_ext.setdefault(f.ext, []).append(f)
+            if f.has_video:
+                self.by_height.setdefault(f.height, []).append(f)
+        self.by_height = dict(sorted(self.by_height.items(), reverse=True))
+
+        # Lista exibida pelo /check-video: uma entrada por resolução/extensão
+        self.listing = []
+        for height, formats in self.by_height.items():
+            seen_exts = set()
+            for f in formats:
+                if f.ext in seen_exts:
+                    continue
+                seen_exts.add(f.ext)
+                self.listing.append({
+                    'format_id': f.format_id,
+                    'resolution': f"{height}p",
+                    'ext': f.ext,
+                    'filesize_approx': format_filesize(f.filesize)
+                })
+        
+        # Somente áudio, extraído pelo pós-processamento
+        audio = self.best_audio()
+        if audio is not None and FFMPEG_PATH:
+            for convert in AUDIO_TARGETS:
+                self.listing.append({
+                    'format_id': audio.format_id,
+                    'resolution': None,
+                    'ext': convert,
+                    'convert': convert,
+                    'filesize_approx': format_filesize(audio.filesize)
+                })
+
+    def select(self, format_id=None):
+        """Format requested by format_id, or the default (best mp4)"""
+        return self.by_id.get(format_id) if format_id else self.best('mp4')
+
+    def resolve(self, format_id=None):
+        """The format_id a request resolves to (the default becomes a real ID)"""
+        if format_id and '+' in format_id:
+            return format_id
+        fmt = self.select(format_id)
+        return fmt.format_id if fmt is not None else format_id
+
+    def best(self, ext=None, max_height=None):
+        """Best format (yt-dlp lists worst to best) matching ext/max_height"""
+        candidates = self.by_ext.get(ext, ()) if ext else self.formats
+        if max_height:
+            candidates = [f for f in candidates if not f.height or f.height <= max_height]
+        complete = [f for f in candidates if f.has_video and f.has_audio]
+        if complete:
+            return complete[-1]
+        return candidates[-1] if candidates else None
+
+    def best_audio(self, ext=None):
+        """Best audio-only format, preferring ext when there is one"""
+        audio = [f for f in self.formats if f.has_audio and not f.has_video]
+        preferred = [f for f in audio if f.ext == ext]
+        candidates = preferred or audio
+        return candidates[-1] if candidates else None
+
+# ======================================================================
+
+# Cache das informações extraídas pelo yt-dlp (extract_info)
+
+class InfoCache:
+    """TTL/LRU cache of VideoInfo objects with an optional disk backend"""
+
+    def __init__(self, ttl, max_bytes, cache_dir=None):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (expira_em, tamanho, info)
+        self._size = 0
+        self._lock = threading.Lock()
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def _disk_path(self, key):
+        return os.path.join(self.cache_dir, hashlib.sha1(key.encode()).hexdigest() + '.json')
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            item = self._entries.get(key)
+            if item is not None:
+                if item[0] > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return item[2]
+                self._drop(key)
+
+        info = self._disk_get(key, now)
+        with self._lock:
+            if info is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        self._put_memory(key, info, len(json.dumps(info.to_json())), now + self.ttl)
+        return info
+
+    def put(self, key, info):
+        data = json.dumps(info.to_json())
+        self._put_memory(key, info, len(data), time.time() + self.ttl)
+        if self.cache_dir:
+            tmp_file = self._disk_path(key) + '.tmp'
+            try:
+                with open(tmp_file, 'w', encoding='utf-8') as f:
+                    f.write(data)
+                os.replace(tmp_file, self._disk_path(key))
+            except OSError as e:
+                app.logger.error(f"Error writing info cache for {key}: {str(e)}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self._entries),
+                'bytes': self._size
+            }
+
+    def _disk_get(self, key, now):
+        if not self.cache_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            if os.path.getmtime(path) + self.ttl <= now:
+                os.unlink(path)
+                return None
+            with open(path, encoding='utf-8') as f:
+                return VideoInfo.from_json(json.load(f))
+        except (OSError, ValueError, IndexError, TypeError):
+            return None
+
+    def _put_memory(self, key, info, size, expires):
+        # O tamanho é o do JSON serializado, uma aproximação do uso de memória
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (expires, size, info)
+            self._size += size
+            while self._size > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+
+    def _drop(self, key):
+        self._size -= self._entries.pop(key)[1]
+
+info_cache = InfoCache(INFO_CACHE_TTL, INFO_CACHE_MAX_BYTES, INFO_CACHE_DIR)
+
+# ======================================================================
+
+# Pool de instâncias do YoutubeDL, uma lista por perfil de opções
+
+# Opções do yt-dlp usadas apenas para extrair informações
+INFO_YDL_OPTS = {
+    'quiet': True,
+    'no_warnings': True,
+    'noplaylist': True,
+    'nocheckcertificate': True,
+    'http_headers': dict(DEFAULT_HEADERS)
+}
+
+DOWNLOAD_YDL_OPTS = dict(INFO_YDL_OPTS, **{
+    # Mesmo subdiretório de StorageManager.shard_dir (dois primeiros caracteres do ID)
+    # O format_id no nome separa vídeo e áudio baixados para um merge
+    'outtmpl': os.path.join(DOWNLOAD_FOLDER, '%(id.0:2)s', '%(title)s_%(id)s_%(format_id)s.%(ext)s'),
+    'restrictfilenames': True,
+    'quiet': False,
+    'no_warnings': False
+    # O yt-dlp já retoma o seu .part por padrão, só pelo tamanho (sem ETag/Last-Modified);
+    # um .part abandonado é apagado pelo StorageManager.sweep após STORAGE_ORPHAN_TTL
+})
+
+YDL_PROFILES = {
+    'info': INFO_YDL_OPTS,
+    'playlist': dict(INFO_YDL_OPTS, noplaylist=False, extract_flat='in_playlist'),
+    'download': DOWNLOAD_YDL_OPTS,
+    'download-ssl': dict(DOWNLOAD_YDL_OPTS, nocheckcertificate=False)
+}
+
+# O import do yt-dlp (centenas de módulos) fica fora do import do app
+yt_dlp = None
+yt_dlp_lock = threading.Lock()
+
+def load_yt_dlp(extractor=None):
+    """Import yt-dlp on first use (and optionally an extractor's module)"""
+    global yt_dlp
+    if yt_dlp is None or (extractor and 'extractor_load' not in startup_times):
+        with yt_dlp_lock:
+            if yt_dlp is None:
+                started = time.perf_counter()
+                import yt_dlp as module
+                yt_dlp = module
+                startup_times['yt_dlp_import'] = time.perf_counter() - started
+            if extractor and 'extractor_load' not in startup_times:
+                started = time.perf_counter()
+                ie = yt_dlp.extractor.get_info_extractor(extractor)
+                getattr(ie, 'real_class', ie)  # com lazy_extractors, importa o módulo real
+                startup_times['extractor_load'] = time.perf_counter() - started
+    return yt_dlp
+
+class YoutubeDLPool:
+    """Reusable YoutubeDL instances, keyed by option profile.
+
+    Creating a YoutubeDL loads plugins, the cookie jar and HTTP handlers,
+    and its extractors are initialised on first use; a pooled instance pays
+    for that once. Each instance is used by one thread at a time: checkout()
+    sets the per-job format and progress hook and clears them on return.
+    Instances that raised are closed instead of going back to the pool, and
+    each one is recycled after max_uses jobs.
+    """
+
+    def __init__(self, profiles, max_idle, max_uses):
+        self.profiles = profiles
+        self.max_idle = max_idle
+        self.max_uses = max_uses
+        self._idle = {name: [] for name in profiles}  # perfil -> [(instância, usos)]
+        self._lock = threading.Lock()
+        self.created = 0
+
+    def _create(self, profile):
+        # Cada instância recebe a sua cópia das opções, pois o yt-dlp altera o dict
+        ydl = load_yt_dlp().YoutubeDL(copy.deepcopy(self.profiles[profile]))
+        with self._lock:
+            self.created += 1
+        return ydl
+
+    @contextlib.contextmanager
+    def checkout(self, profile, format_spec=None, progress_hook=None):
+        with self._lock:
+            idle = self._idle[profile]
+            ydl, uses = idle.pop() if idle else (None, 0)
+        if ydl is None:
+            ydl = self._create(profile)
+        
+        try:
+            if format_spec:
+                ydl.params['format'] = format_spec
+                ydl.format_selector = ydl.build_format_selector(format_spec)
+            if progress_hook:
+                ydl.add_progress_hook(progress_hook)
+            yield ydl
+        except BaseException:
+            ydl.close()
+            raise
+        
+        ydl.params.pop('format', None)
+        ydl.params['ratelimit'] = self.profiles[profile].get('ratelimit')  # ajustado pelo BandwidthManager
+        ydl.format_selector = None
+        ydl._progress_hooks.clear()
+        self._checkin(profile, ydl, uses + 1)
+
+    def _checkin(self, profile, ydl, uses):
+        with self._lock:
+            if uses < self.max_uses and len(self._idle[profile]) < self.max_idle:
+                self._idle[profile].append((ydl, uses))
+                return
+        ydl.close()
+
+    def warm_up(self, profiles=None):
+        """Create one instance per profile and load the YouTube extractor"""
+        for profile in profiles or self.profiles:
+            try:
+                load_yt_dlp(extractor='Youtube')
+                ydl = self._create(profile)
+                if hasattr(ydl, 'get_info_extractor'):
+                    ydl.get_info_extractor('Youtube')
+                self._checkin(profile, ydl, 0)
+            except Exception as e:
+                app.logger.error(f"Error warming up YoutubeDL profile {profile}: {str(e)}")
+
+    def stats(self):
+        with self._lock:
+            return {'created': self.created, 'idle': sum(len(idle) for idle in self._idle.values())}
+
+ydl_pool = YoutubeDLPool(YDL_PROFILES, YDL_POOL_SIZE, YDL_POOL_MAX_USES)
+
+def start_warm_up():
+    threading.Thread(target=ydl_pool.warm_up, daemon=True, name='ydl-warm-up').start()
+
+def start_background_tasks():
+    """Warm-up do yt-dlp e janitor do armazenamento (uma vez por processo)"""
+    start_warm_up()
+    start_janitor()
+
+def create_app(preload=False):
+    """Finish the process-wide setup and return the Flask app.
+
+    Routes and shared state live at module level, so importing the module
+    stays cheap: yt-dlp is only imported by the background warm-up (or by
+    the first request that needs it). With preload=True, used by gunicorn
+    --preload, yt-dlp and the YouTube extractor are imported right away in
+    the master process, so forked workers share those modules copy-on-write.
+    Background threads do not survive fork(): each worker (or the
+    development server) calls start_background_tasks() itself.
+    """
+    # Adicionar tratamento para erros SSL
+    ssl._create_default_https_context = ssl._create_unverified_context
+    if preload:
+        load_yt_dlp(extractor='Youtube')
+    return app
+
+def get_video_info(url):
+    """Return the (cached) VideoInfo for url"""
+    parsed = parse_youtube_url(url)
+    key = parsed.video_id if parsed and parsed.video_id else url
+    info = info_cache.get(key)
+    if info is None:
+        started = time.perf_counter()
+        with span('extract_info'), ydl_pool.checkout('info') as ydl:
+            info = VideoInfo.from_info_dict(ydl.extract_info(url, download=False))
+        EXTRACT_INFO_SECONDS.observe(time.perf_counter() - started)
+        info_cache.put(key, info)
+    return info
+
+def complete_from_cache(download_id, entry):
+    DOWNLOADS_TOTAL.inc('cache', 'success')
+    progress_store.update(download_id, {
+        'status': 'completed',
+        'percent': 100,
+        'speed': '0 MB/s',
+        'cached': True,
+        'filepath': entry['filepath'],
+        'filename': entry['filename']
+    })
+
+def progress_leader(download_id):
+    """ID of the download whose progress download_id shows (itself if it follows none)"""
+    # Um download pode seguir outro que, ao resolver o formato, passou a seguir um terceiro
+    for _ in range(3):
+        progress_data = progress_store.get(download_id)
+        if not progress_data or 'follows' not in progress_data:
+            break
+        download_id = progress_data['follows']
+    return download_id
+
+def resolve_progress(download_id):
+    """Progress entry for download_id, following deduplicated downloads"""
+    return progress_store.get(progress_leader(download_id))
 
 def sanitize_filename(filename):
     """Remove invalid characters from filename"""
@@ -47,15 +1608,44 @@ def sanitize_filename(filename):
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+# Bytes de cada download já contabilizados nas métricas (o yt-dlp informa o total acumulado)
+hook_counted_bytes = {}
+
+def track_ytdlp_files(d, download_id):
+    # Registrar no StorageManager os arquivos que o yt-dlp está escrevendo
+    for name in ('tmpfilename', 'filename'):
+        if d.get(name):
+            storage.track(d[name], download_id)
+    if d.get('tmpfilename'):
+        storage.track(d['tmpfilename'] + '.ytdl', download_id)
+
+def ytdlp_output_path(info):
+    """Path of the file yt-dlp wrote for info, without listing directories"""
+    for download in info.get('requested_downloads') or []:
+        if download.get('filepath'):
+            return download['filepath']
+    return info.get('filepath') or storage.find(info.get('id', 'unknown'), info.get('format_id'),
+                                                info.get('ext', 'mp4'))
+
 # Função de callback para monitorar o progresso do download
-def progress_hook(d):
-    download_id = d.get('_download_id')
-    if not download_id or download_id not in download_progress:
+def progress_hook(d, download_id=None):
+    download_id = download_id or d.get('_download_id')
+    if not download_id:
         return
     
     if d['status'] == 'downloading':
-        total_bytes = d.get('total_bytes') or d.get('total_bytes_estimate', 0)
+        # Chamado a cada bloco, na thread do download: contabilizar e limitar a banda
+        # aqui e descartar cedo as atualizações de progresso limitadas
         downloaded_bytes = d.get('downloaded_bytes', 0)
+        previous = hook_counted_bytes.get(download_id)  # None no primeiro bloco (ou ao retomar um .part)
+        hook_counted_bytes[download_id] = downloaded_bytes
+        if previous is not None and downloaded_bytes > previous:
+            count_downloaded('yt-dlp', downloaded_bytes - previous)
+            bandwidth.consume(download_id, downloaded_bytes - previous)
+        if not progress_store.due(download_id):
+            return
+        track_ytdlp_files(d, download_id)
+        total_bytes = d.get('total_bytes') or d.get('total_bytes_estimate', 0)
         
         if total_bytes > 0:
             percent = int(downloaded_bytes / total_bytes * 100)
@@ -65,457 +1655,1307 @@ def progress_hook(d):
             else:
                 speed_str = "Calculando..."
                 
-            download_progress[download_id].update({
+            progress_store.update(download_id, dict(bandwidth_progress(download_id), **{
                 'percent': percent,
                 'speed': speed_str,
-                'status': 'downloading'
-            })
+                'status': 'downloading',
+                'downloaded_bytes': downloaded_bytes,
+                'total_bytes': total_bytes
+            }))
     
     elif d['status'] == 'finished':
-        download_progress[download_id].update({
+        # Cada arquivo (vídeo e áudio separados, por exemplo) recomeça a contagem
+        downloaded_bytes = d.get('downloaded_bytes') or d.get('total_bytes') or 0
+        count_downloaded('yt-dlp', max(0, downloaded_bytes - hook_counted_bytes.pop(download_id, 0)))
+        track_ytdlp_files(d, download_id)
+        progress_store.update(download_id, {
             'percent': 100,
             'speed': '0 MB/s',
             'status': 'processing'
         })
     
     elif d['status'] == 'error':
-        download_progress[download_id].update({
+        progress_store.update(download_id, {
             'status': 'error',
             'error': d.get('error', 'Erro desconhecido')
         })
 
-def download_video(url, download_id):
-    max_retries = 3
-    retry_count = 0
+# ======================================================================
+
+# Escolha do método de download: saúde por método, backoff e circuit breaker
+
+class MethodHealth:
+    """Success rate and cost (seconds per MiB) of a download method, as
+    exponentially weighted averages, plus its circuit breaker state."""
+
+    def __init__(self, cooldown):
+        self.success_rate = 1.0
+        self.cost = None  # desconhecido até o primeiro sucesso
+        self.updated = 0
+        self.consecutive_failures = 0
+        self.open_until = 0
+        self.cooldown = cooldown
+        self.trial_running = False
+
+class FallbackEngine:
+    """Orders download methods by health and decides how long to back off.
+
+    Each method keeps a success rate and an average cost across jobs.
+    order() puts the healthiest method first; the failures of a method that
+    is no longer being tried fade with a half-life of one cooldown, so it
+    gets another chance later. A method whose circuit is open
+    is skipped until its cooldown expires. After that a single trial job is
+    allowed through (half-open): success closes the circuit, failure opens
+    it again with a doubled cooldown.
+    """
+
+    ALPHA = 0.2  # peso de cada nova observação nas médias
+    # Espera base (s) antes da próxima tentativa, por classe de erro
+    BACKOFF_BASE = {'rate_limit': 5.0, 'server': 2.0, 'network': 1.0, 'other': 1.0}
+    BACKOFF_MAX = 60.0
+    # Erros do vídeo ou do pedido, não do método: não adianta tentar de novo
+    PERMANENT = ('unavailable', 'format', 'storage')
+
+    def __init__(self, threshold, cooldown, max_cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self._health = {}
+        self._lock = threading.Lock()
+
+    def _get(self, method):
+        health = self._health.get(method)
+        if health is None:
+            health = self._health[method] = MethodHealth(self.cooldown)
+        return health
+
+    def order(self, methods, avoid=()):
+        """Available methods, healthiest first; methods in avoid go last.
+
+        Claims the half-open trial of a method whose cooldown has expired,
+        so callers must record() the outcome of the method they run.
+        """
+        now = time.time()
+        available = []
+        with self._lock:
+            rank = {}
+            for method in methods:
+                health = self._get(method)
+                if health.open_until > now or health.trial_running:
+                    continue
+                available.append(method)
+                success_rate = 1 - (1 - health.success_rate) * 0.5 ** ((now - health.updated) / self.cooldown)
+                # Arredondado para que ruído não troque a ordem; o sort é estável e
+                # os empates mantêm a ordem de preferência recebida
+                rank[method] = (method in avoid, -round(success_rate, 1),
+                                round(health.cost, 1) if health.cost is not None else float('inf'))
+            available.sort(key=rank.get)
+            if available:
+                health = self._health[available[0]]
+                if health.open_until:
+                    health.trial_running = True  # meio aberto: só um job testa o método
+        return available
+
+    def record(self, method, ok, cost=None):
+        """Record an attempt: ok=True/False, or None for errors not caused by the method"""
+        with self._lock:
+            health = self._get(method)
+            health.trial_running = False
+            if ok is None:
+                return
+            health.success_rate += self.ALPHA * ((1.0 if ok else 0.0) - health.success_rate)
+            health.updated = time.time()
+            if ok:
+                if cost is not None:
+                    health.cost = cost if health.cost is None else health.cost + self.ALPHA * (cost - health.cost)
+                health.consecutive_failures = 0
+                health.open_until = 0
+                health.cooldown = self.cooldown
+                return
+            health.consecutive_failures += 1
+            if health.open_until:
+                # Falhou no teste do estado meio aberto: abrir de novo por mais tempo
+                health.cooldown = min(health.cooldown * 2, self.max_cooldown)
+                health.open_until = time.time() + health.cooldown
+            elif health.consecutive_failures >= self.threshold:
+                health.open_until = time.time() + health.cooldown
+                app.logger.warning(f"Circuit open for download method {method} ({health.cooldown}s)")
+
+    def backoff(self, error_class, attempt):
+        """Jittered exponential delay before retry number attempt (1-based)"""
+        base = self.BACKOFF_BASE.get(error_class)
+        if base is None:
+            return 0  # ssl/forbidden: trocar de método imediatamente
+        return random.uniform(0, min(self.BACKOFF_MAX, base * 2 ** (attempt - 1)))
+
+    def snapshot(self):
+        with self._lock:
+            return {method: {'success_rate': health.success_rate, 'cost': health.cost,
+                             'open': health.open_until > time.time()}
+                    for method, health in self._health.items()}
+
+def classify_error(error):
+    """Error class used for backoff and health decisions"""
+    if isinstance(error, StorageFullError):
+        return 'storage'
+    if isinstance(error, ssl.SSLError):
+        return 'ssl'
+    if isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                          ConnectionError, TimeoutError)):
+        return 'network'
+    status = None
+    if isinstance(error, requests.exceptions.HTTPError) and error.response is not None:
+        status = error.response.status_code
+    message = str(error)
+    if status is None:
+        # yt-dlp: "HTTP Error 429: ..."; requests: "503 Server Error: ..."
+        match = re.search(r'HTTP Error (\d{3})|^(\d{3}) (?:Client|Server) Error', message)
+        if match:
+            status = int(match.group(1) or match.group(2))
+    if status == 429 or 'Too Many Requests' in message:
+        return 'rate_limit'
+    if status is not None and status >= 500:
+        return 'server'
+    if status in (401, 403):
+        return 'forbidden'
+    if 'CERTIFICATE_VERIFY_FAILED' in message or 'SSL' in message:
+        return 'ssl'
+    if any(text in message for text in ('Video unavailable', 'Private video', 'removed by the uploader',
+                                        'not available in your country', 'members-only')):
+        return 'unavailable'
+    if 'Requested format is not available' in message:
+        return 'format'
+    if any(text in message for text in ('timed out', 'Connection reset', 'Connection aborted',
+                                        'IncompleteRead', 'Conexão encerrada')):
+        return 'network'
+    return 'other'
+
+fallback_engine = FallbackEngine(BREAKER_THRESHOLD, BREAKER_COOLDOWN, BREAKER_MAX_COOLDOWN)
+
+def download_with_fallback(info, download_id, format_id, methods):
+    """Run the download methods in health order until one succeeds.
+
+    Returns (filepath, filename, method). Raises the last error when the
+    attempts run out, an error is permanent or every circuit is open.
+    """
+    failed = []
     last_error = None
-    
-    while retry_count < max_retries:
-        try:
-            # Atualizar status para mostrar tentativa
-            download_progress[download_id].update({
-                'status': 'trying',
-                'percent': 0,
-                'speed': '0 MB/s',
-                'title': f'Tentativa {retry_count + 1}/{max_retries}...'
+    for attempt in range(1, MAX_DOWNLOAD_ATTEMPTS + 1):
+        candidates = fallback_engine.order(methods, avoid=failed)
+        if not candidates:
+            raise last_error or RuntimeError('Métodos de download temporariamente indisponíveis')
+        method = candidates[0]
+        
+        if attempt > 1:
+            DOWNLOAD_RETRIES.inc(method)
+            progress_store.update(download_id, {
+                'status': 'retrying',
+                'title': f'Tentativa {attempt}/{MAX_DOWNLOAD_ATTEMPTS} ({method})...'
             })
-            
-            # Extract video ID for logging purposes
-            video_id = None
-            if "youtube.com/watch" in url:
-                query_params = url.split("?")[1] if "?" in url else ""
-                params = query_params.split("&")
-                for param in params:
-                    if param.startswith("v="):
-                        video_id = param[2:]
-                        break
-            elif "youtu.be/" in url:
-                video_id = url.split("youtu.be/")[1].split("?")[0].split("&")[0]
-            
-            app.logger.info(f"Attempt {retry_count + 1}/{max_retries} to download video with ID: {video_id}")
-            
-            # Diferentes métodos de download baseados na tentativa atual
-            if retry_count == 0:
-                # Primeira tentativa: método requests com SSL desativado
-                download_with_requests(url, download_id, video_id)
-                return  # Se bem-sucedido, retorna
-                
-            elif retry_count == 1:
-                # Segunda tentativa: método yt-dlp com opções SSL personalizadas
-                download_with_ytdlp(url, download_id, video_id, ssl_verify=False)
-                return  # Se bem-sucedido, retorna
-                
-            else:
-                # Terceira tentativa: método yt-dlp com configurações padrão
-                download_with_ytdlp(url, download_id, video_id, ssl_verify=True)
-                return  # Se bem-sucedido, retorna
-                
+        app.logger.info(f"Attempt {attempt}/{MAX_DOWNLOAD_ATTEMPTS} for {info.id} with {method}")
+        
+        started = time.time()
+        try:
+            filepath, filename = DOWNLOAD_METHODS[method](info, download_id, format_id)
         except Exception as e:
-            retry_count += 1
-            last_error = str(e)
-            app.logger.error(f"Download attempt {retry_count}/{max_retries} failed: {last_error}")
-            time.sleep(2)  # Esperar antes da próxima tentativa
-    
-    # Se chegou aqui, todas as tentativas falharam
-    app.logger.error(f"All download attempts failed: {last_error}")
-    download_progress[download_id].update({
-        'status': 'error',
-        'error': f"Falha após {max_retries} tentativas: {last_error}"
-    })
+            error_class = classify_error(e)
+            permanent = error_class in FallbackEngine.PERMANENT
+            fallback_engine.record(method, None if permanent else False)
+            DOWNLOADS_TOTAL.inc(method, 'failure')
+            app.logger.error(f"Download attempt {attempt} with {method} failed ({error_class}): {str(e)}")
+            last_error = e
+            if permanent or attempt == MAX_DOWNLOAD_ATTEMPTS:
+                raise
+            failed.append(method)
+            time.sleep(fallback_engine.backoff(error_class, attempt))
+            continue
+        
+        size_mib = os.path.getsize(filepath) / 1024 / 1024 if os.path.isfile(filepath) else 0
+        fallback_engine.record(method, True, (time.time() - started) / max(size_mib, 1))
+        DOWNLOADS_TOTAL.inc(method, 'success')
+        return filepath, filename, method
+    raise last_error
+
+# Função para download usando requests
+def download_with_requests(info, download_id, format_id=None):
+    """Download a single direct format with parallel Range requests.
+
+    Returns (filepath, download name).
+    """
+    fmt = info.select(format_id)
+    if fmt is None or not fmt.url:
+        raise ValueError("Não foi possível obter a URL direta do vídeo")
+    
+    title = info.title or 'video'
+    filepath, download_name = direct_download_path(info, fmt)
+    headers = format_headers(fmt)
+    for path in (filepath, filepath + '.seg.part', filepath + '.seg.state.json'):
+        storage.track(path, download_id)
+    
+    start_time = time.time()
+    
+    def on_progress(downloaded, total_size):
+        if total_size <= 0 or not progress_store.due(download_id):
+            return
+        fields = bandwidth_progress(download_id)
+        if time.time() - start_time < BandwidthManager.INTERVAL * 2:
+            # Ainda sem medição: média desde o início
+            elapsed = time.time() - start_time
+            fields['speed'] = f"{downloaded / elapsed / 1024 / 1024 if elapsed > 0 else 0:.2f} MB/s"
+        progress_store.update(download_id, dict(fields, **{
+            'percent': int(downloaded / total_size * 100),
+            'status': 'downloading',
+            'title': title,
+            'downloaded_bytes': downloaded,
+            'total_bytes': total_size
+        }))
+    
+    with span('chunk_loop'):
+        download_segmented(fmt.url, filepath, headers, on_progress, job_id=download_id)
+    return filepath, download_name
+
+def direct_download_path(info, fmt):
+    """Return (filepath, download name) of a format fetched directly"""
+    sanitized_title = sanitize_filename(info.title or 'video')
+    ext = fmt.ext or 'mp4'
+    # O format_id no nome permite retomar cada formato separadamente
+    filename = f"{sanitized_title}_{info.id or 'unknown'}_{fmt.format_id}.{ext}"
+    return os.path.join(storage.shard_dir(info.id), filename), f"{sanitized_title}.{ext}"
+
+def format_headers(fmt):
+    headers = dict(DEFAULT_HEADERS)
+    headers.update(fmt.http_headers or {})
+    return headers
+
+def probe_size(url, headers):
+    """Probe url with a one-byte Range request.
+
+    Returns (total_size, accepts_ranges, validators), where validators holds
+    the ETag/Last-Modified headers used to check that a resumed download
+    still refers to the same file.
+    """
+    response = download_session.get(url, headers=dict(headers, Range='bytes=0-0'),
+                                    stream=True, timeout=30)
+    with response:
+        response.raise_for_status()
+        validators = {
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified')
+        }
+        content_range = response.headers.get('Content-Range', '')
+        if response.status_code == 206 and '/' in content_range:
+            total = content_range.rsplit('/', 1)[1]
+            if total.isdigit():
+                return int(total), True, validators
+        return int(response.headers.get('content-length', 0)), False, validators
 
-# Função para download usando requests
-def download_with_requests(url, download_id, video_id):
-    # Set up yt-dlp options apenas para extrair informações
-    ydl_opts = {
-       'format': 'best[ext=mp4]',
-        'outtmpl': os.path.join(DOWNLOAD_FOLDER, '%(title)s_%(id)s.%(ext)s'),
-        'restrictfilenames': True,
-        'noplaylist': True,
-        'quiet': False,
-        'no_warnings': False,
-        'progress_hooks': [progress_hook],
-        '_download_id': download_id,
-        'nocheckcertificate': not ssl_verify,
-        'http_headers': {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-        },
-        'socket_timeout': 30,  
-        'retries': 10,         
-        'fragment_retries': 10, 
-        'external_downloader_args': ['-retry', '10'] 
-    }
+def load_download_state(state_path, part_path, total_size, validators):
+    """Return the saved segments of a partial download, if still valid"""
+    try:
+        with open(state_path, encoding='utf-8') as f:
+            state = json.load(f)
+        if (state['total_size'] == total_size and state['validators'] == validators
+                and os.path.getsize(part_path) == total_size):
+            return state['segments']
+    except (OSError, ValueError, KeyError):
+        pass
+    return None
+
+def save_download_state(state_path, total_size, validators, segments):
+    tmp_file = state_path + '.tmp'
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump({'total_size': total_size, 'validators': validators, 'segments': segments}, f)
+    os.replace(tmp_file, state_path)
+
+def download_segmented(url, filepath, headers, on_progress,
+                       segments=DOWNLOAD_SEGMENTS, chunk_size=DOWNLOAD_CHUNK_SIZE, job_id=None):
+    """Download url into filepath, splitting it into concurrent byte ranges.
+
+    Data is written to filepath + '.seg.part' and the completed ranges are
+    kept in a '.seg.state.json' sidecar, so a later call for the same file
+    continues from the last good byte (yt-dlp would append to this presized
+    file if it shared its '.part' name). Falls back to a single
+    (non-resumable) stream when the server does not honour Range requests.
+    on_progress(downloaded, total) is called after every chunk, and every
+    segment thread spends the bandwidth share of job_id.
+    """
+    part_path = filepath + '.seg.part'
+    state_path = filepath + '.seg.state.json'
+    total_size, accepts_ranges, validators = probe_size(url, headers)
     
-    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-        info = ydl.extract_info(url, download=False)
-        title = info.get('title', 'video')
-        video_id = info.get('id', 'unknown')
-        ext = 'mp4'
-        
-        # Obter a URL direta do vídeo
-        if 'url' in info:
-            direct_url = info['url']
-        elif 'formats' in info and len(info['formats']) > 0:
-            # Pegar o formato com melhor qualidade
-            formats = [f for f in info['formats'] if f.get('ext') == 'mp4']
-            if formats:
-                direct_url = formats[-1]['url']
-            else:
-                direct_url = info['formats'][-1]['url']
-        else:
-            raise ValueError("Não foi possível obter a URL direta do vídeo")
-        
-        # Baixar usando requests
-        sanitized_title = sanitize_filename(title)
-        filename = f"{sanitized_title}_{video_id}.{ext}"
-        filepath = os.path.join(DOWNLOAD_FOLDER, filename)
-        
-        # Configurar a sessão com opções SSL personalizadas e retry
-        session = requests.Session()
-        session.verify = False  # Desativa verificação SSL
-        
-        # Configurar retry com backoff exponencial
-        retry_strategy = Retry(
-            total=5,
-            backoff_factor=1,
-            status_forcelist=[429, 500, 502, 503, 504],
-            allowed_methods=["GET"]
-        )
-        adapter = HTTPAdapter(max_retries=retry_strategy)
-        session.mount("http://", adapter)
-        session.mount("https://", adapter)
-        
-        # Suprimir avisos de SSL inseguro
-        import warnings
-        warnings.filterwarnings('ignore', message='Unverified HTTPS request')
-        
-        # Usar a sessão configurada para o download
-        response = session.get(
-            direct_url, 
-            stream=True,
-            headers={
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-            },
-            timeout=30  # Aumentar o timeout
-        )
-        total_size = int(response.headers.get('content-length', 0))
-        
-        with open(filepath, 'wb') as f:
-            downloaded = 0
-            start_time = time.time()
-            for chunk in response.iter_content(chunk_size=8192):
+    lock = threading.Lock()
+    downloaded = 0
+    
+    def add_progress(size):
+        nonlocal downloaded
+        with lock:
+            downloaded += size
+            current = downloaded
+        count_downloaded('requests', size)
+        bandwidth.consume(job_id, size)
+        on_progress(current, total_size)
+    
+    if not accepts_ranges:
+        response = download_session.get(url, headers=headers, stream=True, timeout=30)
+        with response, open(part_path, 'wb') as f:
+            response.raise_for_status()
+            for chunk in response.iter_content(chunk_size=chunk_size):
                 if chunk:
                     f.write(chunk)
-                    downloaded += len(chunk)
-                    
-                    # Calcular velocidade
-                    elapsed = time.time() - start_time
-                    if elapsed > 0:
-                        speed = downloaded / elapsed / 1024 / 1024  # MB/s
-                    else:
-                        speed = 0
-                    
-                    # Atualizar progresso
-                    if total_size > 0:
-                        percent = int(downloaded / total_size * 100)
-                        download_progress[download_id].update({
-                            'percent': percent,
-                            'speed': f"{speed:.2f} MB/s",
-                            'status': 'downloading',
-                            'title': title
-                        })
-        
-        # Atualizar o progresso para concluído
-        download_progress[download_id].update({
-            'status': 'completed',
-            'percent': 100,
-            'filepath': filepath,
-            'filename': sanitized_title + '.' + ext
-        })
+                    add_progress(len(chunk))
+        os.replace(part_path, filepath)
+        return
+    
+    # Cada segmento é [início, fim, próxima posição a baixar]
+    saved_segments = load_download_state(state_path, part_path, total_size, validators)
+    if saved_segments:
+        segment_list = saved_segments
+        downloaded = sum(position - start for start, end, position in segment_list)
+        app.logger.info(f"Resuming {filepath} at {downloaded}/{total_size} bytes")
+    else:
+        segments = min(segments, max(1, total_size // MIN_SEGMENT_SIZE))
+        segment_size = -(-total_size // segments)
+        segment_list = [[start, min(start + segment_size, total_size) - 1, start]
+                        for start in range(0, total_size, segment_size)]
+        # Pré-alocar o arquivo para que cada segmento escreva no seu offset
+        with open(part_path, 'wb') as f:
+            f.truncate(total_size)
+    
+    last_save = time.time()
+    
+    def checkpoint(force=False):
+        nonlocal last_save
+        with lock:
+            if force or time.time() - last_save >= 1:
+                save_download_state(state_path, total_size, validators, segment_list)
+                last_save = time.time()
+    
+    def fetch_segment(segment):
+        start, end = segment[0], segment[1]
+        attempt = 0
+        while segment[2] <= end:
+            try:
+                response = download_session.get(url, headers=dict(headers, Range=f'bytes={segment[2]}-{end}'),
+                                                stream=True, timeout=30)
+                with response, open(part_path, 'r+b') as f:
+                    if response.status_code != 206:
+                        raise IOError(f"Resposta inesperada para Range: HTTP {response.status_code}")
+                    f.seek(segment[2])
+                    for chunk in response.iter_content(chunk_size=chunk_size):
+                        if not chunk:
+                            continue
+                        chunk = chunk[:end + 1 - segment[2]]
+                        f.write(chunk)
+                        segment[2] += len(chunk)
+                        add_progress(len(chunk))
+                        checkpoint()
+                        if segment[2] > end:
+                            break
+                if segment[2] <= end:
+                    raise IOError("Conexão encerrada antes do fim do segmento")
+            except (requests.exceptions.RequestException, IOError) as e:
+                # Repetir apenas este segmento, a partir do último byte recebido
+                attempt += 1
+                if attempt > SEGMENT_RETRIES:
+                    raise
+                DOWNLOAD_RETRIES.inc('requests')
+                app.logger.warning(f"Segment {start}-{end} failed at {segment[2]} ({str(e)}), retrying")
+                time.sleep(attempt)
+    
+    pending = [segment for segment in segment_list if segment[2] <= segment[1]]
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, len(pending))) as executor:
+            for future in [executor.submit(fetch_segment, segment) for segment in pending]:
+                future.result()
+    except BaseException:
+        # Guardar o que já foi baixado para retomar na próxima tentativa
+        checkpoint(force=True)
+        raise
+    
+    os.replace(part_path, filepath)
+    try:
+        os.unlink(state_path)
+    except OSError:
+        pass
 
 # Função para download usando yt-dlp
-def download_with_ytdlp(url, download_id, video_id, ssl_verify=True):
-    # Set up yt-dlp options
-    ydl_opts = {
-        'format': 'best[ext=mp4]',
-        'outtmpl': os.path.join(DOWNLOAD_FOLDER, '%(title)s_%(id)s.%(ext)s'),
-        'restrictfilenames': True,
-        'noplaylist': True,
-        'quiet': False,
-        'no_warnings': False,
-        'progress_hooks': [progress_hook],
-        '_download_id': download_id,
-        'nocheckcertificate': not ssl_verify,  # Inverter para corresponder ao parâmetro
-        'http_headers': {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-        }
-    }
+def download_with_ytdlp(info, download_id, format_id=None, profile='download'):
+    """Download through yt-dlp, reusing the already extracted info.
+
+    Returns (filepath, download name).
+    """
+    hook = functools.partial(progress_hook, download_id=download_id)
+    with ydl_pool.checkout(profile, format_id or DEFAULT_FORMAT, hook) as ydl:
+        bandwidth.bind(download_id, ydl.params)
+        try:
+            result = ydl.process_ie_result(info.to_ie_result(), download=True)
+        finally:
+            # A instância volta ao pool: o _allocate não pode mais mexer nela
+            bandwidth.bind(download_id, None)
     
-    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-        info = ydl.extract_info(url, download=True)
-        title = info.get('title', 'video')
-        video_id = info.get('id', 'unknown')
-        ext = info.get('ext', 'mp4')
-        
-        # Get the downloaded file path
-        sanitized_title = sanitize_filename(title)
-        downloaded_filename = f"{sanitized_title}_{video_id}.{ext}"
-        filepath = os.path.join(DOWNLOAD_FOLDER, downloaded_filename)
-        
-        # If the file doesn't exist with the expected name, try to find it
-        if not os.path.exists(filepath):
-            for file in os.listdir(DOWNLOAD_FOLDER):
-                if video_id in file and file.endswith(f".{ext}"):
-                    filepath = os.path.join(DOWNLOAD_FOLDER, file)
-                    break
-        
-        app.logger.info(f"Downloaded to: {filepath}")
-        
-        # Atualizar o progresso para concluído
-        download_progress[download_id].update({
-            'status': 'completed',
-            'percent': 100,
-            'filepath': filepath,
-            'filename': sanitized_title + '.' + ext
-        })
+    filepath = ytdlp_output_path(result)
+    if not filepath or not os.path.isfile(filepath):
+        raise IOError("Arquivo baixado não encontrado")
+    return filepath, sanitize_filename(result.get('title', 'video')) + '.' + result.get('ext', 'mp4')
+
+# Métodos na ordem de preferência; a ordem efetiva vem do fallback_engine
+DOWNLOAD_METHODS = {
+    'requests': download_with_requests,
+    'yt-dlp': download_with_ytdlp,
+    'yt-dlp-ssl': functools.partial(download_with_ytdlp, profile='download-ssl')
+}
 
 @app.route('/', methods=['GET'])
 def index():
     return render_template('index.html')
 
-# Adicionar nova rota para verificar o vídeo e obter resoluções disponíveis
-@app.route('/check-video', methods=['POST'])
-def check_video():
-    url = request.form.get('url', '').strip()
-    
+# ======================================================================
+
+# Cliente da YouTube Data API (canais) com cache, coalescência e lotes
+
+class ChannelClient:
+    """Pooled, cached and batching client for the channels.list endpoint.
+
+    Concurrent lookups are collected for batch_window seconds and sent as a
+    single channels?id=a,b,c call (at most MAX_BATCH IDs). Identical
+    in-flight IDs share one Future and results are cached for ttl seconds.
+    An expired channel looked up on its own is revalidated with
+    If-None-Match (a batch ETag covers the whole list, so only single-ID
+    responses keep one).
+    """
+
+    MAX_BATCH = 50
+
+    def __init__(self, api_url, api_key, ttl, batch_window):
+        self.api_url = api_url
+        self.api_key = api_key
+        self.ttl = ttl
+        self.batch_window = batch_window
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_maxsize=4, max_retries=Retry(
+            total=2, backoff_factor=0.5, status_forcelist=[500, 502, 503, 504], allowed_methods=["GET"]))
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._cache = {}  # channel_id -> (expira_em, item ou None)
+        self._etags = {}  # channel_id -> etag da última consulta só desse canal
+        self._inflight = {}
+        self._pending = []
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def get_futures(self, ids):
+        """Return {channel_id: Future} without blocking; results are items or None"""
+        futures = {}
+        now = time.time()
+        with self._cond:
+            for channel_id in ids:
+                if channel_id in futures:
+                    continue
+                cached = self._cache.get(channel_id)
+                if cached and cached[0] > now:
+                    future = Future()
+                    future.set_result(cached[1])
+                elif channel_id in self._inflight:
+                    future = self._inflight[channel_id]
+                else:
+                    future = self._inflight[channel_id] = Future()
+                    self._pending.append(channel_id)
+                futures[channel_id] = future
+            if self._pending:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._batcher, daemon=True, name='channel-batcher')
+                    self._thread.start()
+                self._cond.notify()
+        return futures
+
+    def get_many(self, ids, timeout=30):
+        futures = self.get_futures(ids)
+        return {channel_id: future.result(timeout) for channel_id, future in futures.items()}
+
+    def _batcher(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+            # Esperar um pouco para juntar outras consultas no mesmo lote
+            time.sleep(self.batch_window)
+            with self._cond:
+                batch = self._pending[:self.MAX_BATCH]
+                del self._pending[:self.MAX_BATCH]
+            try:
+                items = self._fetch(batch)
+            except Exception as e:
+                with self._cond:
+                    for channel_id in batch:
+                        self._inflight.pop(channel_id).set_exception(e)
+                continue
+            expires = time.time() + self.ttl
+            with self._cond:
+                for channel_id in batch:
+                    self._cache[channel_id] = (expires, items.get(channel_id))
+                    self._inflight.pop(channel_id).set_result(items.get(channel_id))
+                self._prune(time.time())
+
+    def _fetch(self, batch):
+        headers = {}
+        with self._cond:
+            # O item expirado continua no cache até o _prune e serve para o 304
+            previous = len(batch) == 1 and batch[0] in self._cache and self._etags.get(batch[0])
+        if previous:
+            headers['If-None-Match'] = previous
+        response = self.session.get(self.api_url, headers=headers, timeout=10, params={
+            "part": "snippet,statistics",
+            "id": ",".join(batch),
+            "key": self.api_key,
+            "maxResults": self.MAX_BATCH
+        })
+        if response.status_code == 304 and previous:
+            with self._cond:
+                item = self._cache[batch[0]][1]
+            return {batch[0]: item} if item is not None else {}
+        response.raise_for_status()
+        data = response.json()
+        items = {item['id']: item for item in data.get('items', [])}
+        if len(batch) == 1 and data.get('etag'):
+            with self._cond:
+                self._etags[batch[0]] = data['etag']
+        return items
+
+    def _prune(self, now):
+        # Chamado com o lock; mantém o cache limitado às entradas válidas
+        if len(self._cache) > 10000:
+            for channel_id, (expires, _) in list(self._cache.items()):
+                if expires <= now:
+                    del self._cache[channel_id]
+                    self._etags.pop(channel_id, None)
+
+channel_client = ChannelClient(YOUTUBE_CHANNELS_URL, YOUTUBE_API_KEY, CHANNEL_CACHE_TTL, CHANNEL_BATCH_WINDOW)
+
+def check_video_result(url):
+    """Return the (payload, status) of /check-video for url"""
     if not url:
-        return jsonify({'error': 'URL não fornecida'}), 400
+        return {'error': 'URL não fornecida'}, 400
     
     try:
-        # Validate YouTube URL
-        if "youtube.com" not in url and "youtu.be" not in url:
-            return jsonify({'error': 'URL do YouTube inválida'}), 400
+        # Validate YouTube URL (sem acesso à rede para URLs inválidas)
+        parsed = parse_video_url(url)
+        if parsed is None:
+            return {'error': 'URL do YouTube inválida'}, 400
         
-        # Configurar yt-dlp para extrair informações do vídeo
-        ydl_opts = {
-            'quiet': True,
-            'no_warnings': True,
-            'nocheckcertificate': True,
-            'http_headers': {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-            }
+        # Obter informações do vídeo (do cache quando possível)
+        info = get_video_info(parsed.canonical)
+        
+        # Informações básicas do vídeo e formatos já pré-computados
+        video_info = {
+            'title': info.title or 'Vídeo sem título',
+            'thumbnail': info.thumbnail or '',
+            'duration': info.duration or 0,
+            'formats': info.listing
         }
         
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=False)
-            
-            # Informações básicas do vídeo
-            video_info = {
-                'title': info.get('title', 'Vídeo sem título'),
-                'thumbnail': info.get('thumbnail', ''),
-                'duration': info.get('duration', 0),
-                'formats': []
-            }
-            
-            # Filtrar e organizar formatos disponíveis
-            formats = []
-            seen_resolutions = set()
-            
-            # Primeiro, coletar todos os formatos com vídeo
-            for f in info.get('formats', []):
-                # Pular formatos sem vídeo ou sem informações de resolução
-                if not f.get('height') or f.get('vcodec') == 'none':
-                    continue
-                
-                # Criar identificador de resolução para evitar duplicatas
-                resolution_id = f"{f.get('height')}p_{f.get('ext')}"
-                
-                # Pular se já tivermos esta resolução
-                if resolution_id in seen_resolutions:
-                    continue
-                
-                seen_resolutions.add(resolution_id)
-                
-                # Calcular tamanho aproximado
-                filesize = f.get('filesize')
-                if not filesize:
-                    filesize = f.get('filesize_approx', 0)
-                
-                if filesize:
-                    if filesize > 1024 * 1024 * 1024:  # GB
-                        filesize_str = f"{filesize / (1024 * 1024 * 1024):.1f} GB"
-                    else:  # MB
-                        filesize_str = f"{filesize / (1024 * 1024):.1f} MB"
-                else:
-                    filesize_str = "Desconhecido"
-                
-                formats.append({
-                    'format_id': f.get('format_id'),
-                    'resolution': f"{f.get('height')}p",
-                    'ext': f.get('ext'),
-                    'filesize_approx': filesize_str
-                })
-            
-            # Ordenar por resolução (maior para menor)
-            formats.sort(key=lambda x: int(x['resolution'].replace('p', '')), reverse=True)
-            
-            video_info['formats'] = formats
-            
-            return jsonify(video_info)
+        return video_info, 200
     
     except Exception as e:
         app.logger.error(f"Error checking video: {str(e)}")
-        return jsonify({'error': str(e)}), 500
+        return {'error': str(e)}, 500
+
+# Adicionar nova rota para verificar o vídeo e obter resoluções disponíveis
+@app.route('/check-video', methods=['POST'])
+def check_video():
+    payload, status = check_video_result(request.form.get('url', '').strip())
+    return jsonify(payload), status
+
+def enqueue_download(url, format_id=None, priority=0, convert=None):
+    """Create a download job for url and return its /download response.
+
+    Cached videos complete immediately, videos already being downloaded
+    follow the running job and everything else goes to the scheduler.
+    Raises QueueFullError when the queue is full and StorageFullError when
+    the storage quota is exhausted.
+    """
+    # Gerar ID único para este download
+    download_id = str(uuid.uuid4())
+    
+    # Inicializar o progresso
+    progress_store.create(download_id, {
+        'percent': 0,
+        'speed': '0 MB/s',
+        'status': 'queued',
+        'title': 'Aguardando na fila...'
+    })
+    
+    # Verificar se o vídeo já está no cache ou sendo baixado
+    parsed = parse_video_url(url)
+    video_id = parsed.video_id if parsed else None
+    info = info_cache.get(video_id) if video_id else None
+    cache_key = None
+    if video_id:
+        # Sem as informações em cache o formato ainda não está resolvido: o download_video
+        # troca a chave pela do formato real assim que as obtém
+        cache_key = download_cache.key(video_id, info.resolve(format_id) if info else format_id, convert)
+        entry = download_cache.get(cache_key)
+        if entry:
+            complete_from_cache(download_id, entry)
+            return {'download_id': download_id, 'cached': True}
+        
+        leader = download_cache.claim(cache_key, download_id)
+        if leader is not None:
+            progress_store.update(download_id, {'follows': leader})
+            return {'download_id': download_id}
+    
+    # Enfileirar o download no pool de workers
+    try:
+        if not make_storage_room():
+            raise StorageFullError()
+        position = scheduler.submit(download_id, download_video, (url, download_id, format_id, convert),
+                                    host=media_host(info, format_id), priority=priority)
+    except (QueueFullError, StorageFullError):
+        progress_store.delete(download_id)
+        if cache_key:
+            download_cache.release(cache_key, download_id)
+        raise
+    
+    return {'download_id': download_id, 'queue_position': position}
 
 # Modificar a rota de download para aceitar o format_id
 @app.route('/download', methods=['POST'])
 def start_download():
     url = request.form.get('url', '').strip()
     format_id = request.form.get('format_id', '').strip()
+    convert = request.form.get('convert', '').strip().lower() or None
     
     if not url:
         return jsonify({'error': 'URL não fornecida'}), 400
+    error = check_convert(convert)
+    if error:
+        return jsonify({'error': error}), 400
     
     try:
         # Validate YouTube URL
-        if "youtube.com" not in url and "youtu.be" not in url:
+        parsed = parse_video_url(url)
+        if parsed is None:
             return jsonify({'error': 'URL do YouTube inválida'}), 400
         
-        # Gerar ID único para este download
-        download_id = str(uuid.uuid4())
-        
-        # Inicializar o progresso
-        download_progress[download_id] = {
-            'percent': 0,
-            'speed': '0 MB/s',
-            'status': 'starting',
-            'title': 'Iniciando download...'
-        }
-        
-        # Iniciar o download em uma thread separada
-        thread = threading.Thread(target=download_video, args=(url, download_id, format_id))
-        thread.daemon = True
-        thread.start()
+        try:
+            priority = int(request.form.get('priority', 0))
+        except ValueError:
+            return jsonify({'error': 'Prioridade inválida'}), 400
         
-        return jsonify({'download_id': download_id})
+        try:
+            return jsonify(enqueue_download(parsed.canonical, format_id, priority, convert))
+        except QueueFullError as e:
+            return jsonify({'error': str(e)}), 503
+        except StorageFullError as e:
+            return jsonify({'error': str(e)}), 507
     
     except Exception as e:
         app.logger.error(f"Error starting download: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
-# Modificar a função de download para usar o format_id
-def download_video(url, download_id, format_id=None):
+# ======================================================================
+
+# Downloads em lote (lista de URLs ou playlist)
+
+def expand_playlist(playlist_url):
+    """Return the video URLs of a playlist without extracting each video"""
+    with ydl_pool.checkout('playlist') as ydl:
+        info = ydl.extract_info(playlist_url, download=False)
+    urls = []
+    for entry in info.get('entries') or []:
+        if not entry:
+            continue
+        # Mesma URL canônica (e chave de cache) que um /download do vídeo
+        parsed = parse_video_url(entry.get('url') or f"https://youtu.be/{entry.get('id')}")
+        if parsed is not None:
+            urls.append(parsed.canonical)
+    return list(dict.fromkeys(urls))[:MAX_BATCH_ITEMS]
+
+def run_batch(batch_id, urls, playlist_url, format_id, convert=None):
+    """Pipeline of a batch: extract item N+1 while item N downloads.
+
+    The videos of playlist_url are added after the explicit urls.
+    """
     try:
-        # Extract video ID for logging purposes
-        video_id = None
-        if "youtube.com/watch" in url:
-            query_params = url.split("?")[1] if "?" in url else ""
-            params = query_params.split("&")
-            for param in params:
-                if param.startswith("v="):
-                    video_id = param[2:]
-                    break
-        elif "youtu.be/" in url:
-            video_id = url.split("youtu.be/")[1].split("?")[0].split("&")[0]
+        if playlist_url:
+            progress_store.update(batch_id, {'status': 'extracting', 'title': 'Lendo a playlist...'})
+            entries = expand_playlist(playlist_url)
+            if not entries:
+                raise ValueError('Nenhum vídeo encontrado na playlist')
+            urls = list(dict.fromkeys(urls + entries))[:MAX_BATCH_ITEMS]
         
+        progress_store.update(batch_id, {'status': 'downloading', 'title': f'Lote com {len(urls)} vídeos',
+                                         'total_items': len(urls)})
+        children = []
+        for url in urls:
+            # A extração (que aquece o cache de informações) acontece aqui, enquanto
+            # os workers já baixam os itens anteriores
+            try:
+                get_video_info(url)
+            except Exception as e:
+                app.logger.error(f"Batch {batch_id}: error extracting {url}: {str(e)}")
+            
+            while True:
+                try:
+                    children.append(enqueue_download(url, format_id, convert=convert)['download_id'])
+                    break
+                except QueueFullError:
+                    time.sleep(1)  # esperar espaço na fila
+            progress_store.update(batch_id, {'children': list(children)})
+    
+    except Exception as e:
+        app.logger.error(f"Batch {batch_id} failed: {str(e)}")
+        progress_store.update(batch_id, {'status': 'error', 'error': str(e)})
+
+def batch_payload(batch_id, batch):
+    """Aggregate progress, throughput and ETA of a batch from its children"""
+    children = batch.get('children', [])
+    total_items = batch.get('total_items') or len(children)
+    if batch.get('status') in ('queued', 'extracting', 'error') and not children:
+        return dict(batch, items=[])
+    
+    items = []
+    percent_sum = 0
+    downloaded_bytes = 0
+    finished = failed = 0
+    for child_id in children:
+        child = resolve_progress(child_id) or {'status': 'error', 'error': 'Expirado'}
+        status = child.get('status')
+        percent = 100 if status == 'completed' else child.get('percent', 0)
+        percent_sum += percent
+        downloaded_bytes += child.get('downloaded_bytes', 0)
+        finished += status in FINISHED_STATUSES
+        failed += status == 'error'
+        item = {'download_id': child_id, 'status': status, 'percent': percent, 'title': child.get('title')}
+        if status == 'completed':
+            item['download_url'] = url_for('get_file', download_id=child_id)
+        elif status == 'error':
+            item['error'] = child.get('error')
+        items.append(item)
+    
+    elapsed = max(time.time() - batch['started'], 0.001)
+    fraction = percent_sum / (100 * total_items) if total_items else 0
+    speed = downloaded_bytes / elapsed
+    payload = dict(batch, items=items, finished_items=finished, failed_items=failed,
+                   percent=int(fraction * 100), speed=f"{speed / 1024 / 1024:.2f} MB/s")
+    payload.pop('children', None)
+    if 0 < fraction < 1:
+        payload['eta'] = f"{int(elapsed / fraction - elapsed)}s"
+    
+    if total_items and finished == total_items and batch.get('status') not in FINISHED_STATUSES:
+        status = 'error' if failed == total_items else 'completed'
+        progress_store.update(batch_id, {'status': status})
+        payload['status'] = status
+    return payload
+
+@app.route('/batch', methods=['POST'])
+def start_batch():
+    format_id = request.form.get('format_id', '').strip()
+    convert = request.form.get('convert', '').strip().lower() or None
+    playlist_url = request.form.get('playlist_url', '').strip()
+    
+    urls = []
+    for value in request.form.getlist('urls'):
+        urls.extend(u for u in re.split(r'[\s,]+', value) if u)
+    
+    if not urls and not playlist_url:
+        return jsonify({'error': 'Nenhuma URL fornecida'}), 400
+    error = check_convert(convert)
+    if error:
+        return jsonify({'error': error}), 400
+    
+    rejected = []
+    canonical_urls = []
+    for u in urls:
+        parsed = parse_video_url(u)
+        if parsed is None:
+            rejected.append(u)
+        else:
+            canonical_urls.append(parsed.canonical)
+    urls = list(dict.fromkeys(canonical_urls))[:MAX_BATCH_ITEMS]
+    if playlist_url:
+        parsed = parse_youtube_url(playlist_url)
+        if parsed is None or not parsed.playlist_id:
+            return jsonify({'error': 'URL de playlist inválida'}), 400
+        playlist_url = parsed.playlist_url
+    if not urls and not playlist_url:
+        return jsonify({'error': 'URL do YouTube inválida', 'rejected': rejected}), 400
+    
+    batch_id = str(uuid.uuid4())
+    progress_store.create(batch_id, {
+        'type': 'batch',
+        'status': 'queued',
+        'percent': 0,
+        'speed': '0 MB/s',
+        'title': 'Preparando lote...',
+        'started': time.time(),
+        'total_items': len(urls),
+        'children': []
+    })
+    batch_executor.submit(run_batch, batch_id, urls, playlist_url, format_id, convert)
+    
+    return jsonify({'batch_id': batch_id, 'download_id': batch_id, 'rejected': rejected})
+
+# Modificar a função de download para usar o format_id
+def download_video(url, download_id, format_id=None, convert=None):
+    progress_store.update(download_id, {
+        'status': 'starting',
+        'title': 'Iniciando download...'
+    })
+    
+    parsed = parse_video_url(url)
+    video_id = parsed.video_id if parsed else None
+    cache_key = download_cache.key(video_id, format_id, convert) if video_id else None
+    handed_off = False  # o pós-processamento libera o armazenamento e o cache no fim
+    bandwidth.register(download_id)
+    
+    try:
         app.logger.info(f"Attempting to download video with ID: {video_id}, format: {format_id}")
         
-        # Configurar formato baseado no format_id
-        format_spec = 'best[ext=mp4]'  # Padrão
-        if format_id:
-            format_spec = format_id
+        # Outro download pode ter concluído o mesmo vídeo enquanto este estava na fila
+        entry = download_cache.get(cache_key) if cache_key else None
+        if entry:
+            complete_from_cache(download_id, entry)
+            return
         
-        # Set up yt-dlp options
-        ydl_opts = {
-            'format': format_spec,
-            'outtmpl': os.path.join(DOWNLOAD_FOLDER, '%(title)s_%(id)s.%(ext)s'),
-            'restrictfilenames': True,
-            'noplaylist': True,
-            'quiet': False,
-            'no_warnings': False,
-            'progress_hooks': [progress_hook],
-            '_download_id': download_id,
-            'nocheckcertificate': True,
-            'http_headers': {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-            }
-        }
+        info = get_video_info(url)
+        # O formato pedido (ou o padrão) e o format_id real dividem arquivo e cache; todos
+        # os métodos baixam o formato resolvido, não o DEFAULT_FORMAT do yt-dlp
+        format_id = info.resolve(format_id)
+        resolved_key = download_cache.key(info.id, format_id, convert)
+        if resolved_key != cache_key:
+            entry = download_cache.get(resolved_key)
+            if entry:
+                complete_from_cache(download_id, entry)
+                return
+            leader = download_cache.claim(resolved_key, download_id)
+            if cache_key:
+                download_cache.release(cache_key, download_id)
+            cache_key = resolved_key
+            if leader is not None:
+                # Quem segue este download passa a seguir o leader (resolve_progress)
+                progress_store.update(download_id, {'follows': leader})
+                cache_key = None
+                return
         
-        # Tentar download com yt-dlp
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=True)
-            title = info.get('title', 'video')
-            video_id = info.get('id', 'unknown')
-            ext = info.get('ext', 'mp4')
-            
-            # Get the downloaded file path
-            sanitized_title = sanitize_filename(title)
-            downloaded_filename = f"{sanitized_title}_{video_id}.{ext}"
-            filepath = os.path.join(DOWNLOAD_FOLDER, downloaded_filename)
-            
-            # If the file doesn't exist with the expected name, try to find it
-            if not os.path.exists(filepath):
-                for file in os.listdir(DOWNLOAD_FOLDER):
-                    if video_id in file and file.endswith(f".{ext}"):
-                        filepath = os.path.join(DOWNLOAD_FOLDER, file)
-                        break
-            
-            app.logger.info(f"Downloaded to: {filepath}")
-            
-            # Atualizar o progresso para concluído
-            download_progress[download_id].update({
-                'status': 'completed',
-                'percent': 100,
-                'filepath': filepath,
-                'filename': sanitized_title + '.' + ext
+        parts, target = plan_postprocess(info, format_id, convert)
+        
+        # Reservar espaço para o arquivo (descartando downloads antigos do cache se preciso);
+        # com pós-processamento, a saída ocupa mais ou menos o mesmo que as partes
+        size = sum((fmt.filesize if fmt else None) or 0 for fmt in parts)
+        admit_download(download_id, size * 2 if target else size)
+        
+        downloaded = []
+        for fmt in parts:
+            # Formatos diretos (um único arquivo HTTP) também podem usar o downloader segmentado
+            methods = [m for m in DOWNLOAD_METHODS
+                       if m != 'requests' or (fmt is not None and fmt.protocol in ('http', 'https'))]
+            part_id = fmt.format_id if target else format_id
+            filepath, filename, method = download_with_fallback(info, download_id, part_id, methods)
+            app.logger.info(f"Downloaded {info.id} with {method} to: {filepath}")
+            downloaded.append(filepath)
+        
+        if target:
+            # O worker de download fica livre; o ffmpeg roda no postprocess_executor
+            progress_store.update(download_id, {
+                'status': 'processing',
+                'phase': 'postprocess',
+                'percent': 0,
+                'speed': '0 MB/s',
+                'title': 'Aguardando processamento...'
             })
+            postprocess_executor.submit(run_postprocess, download_id, info, parts, downloaded, target, cache_key)
+            handed_off = True
+            return
+        
+        download_cache.put(cache_key, filepath, filename)
+        
+        # Atualizar o progresso para concluído
+        progress_store.update(download_id, {
+            'status': 'completed',
+            'percent': 100,
+            'title': info.title or 'video',
+            'filepath': filepath,
+            'filename': filename
+        })
     
     except Exception as e:
         app.logger.error(f"Download error: {str(e)}")
-        download_progress[download_id].update({
+        progress_store.update(download_id, {
             'status': 'error',
             'error': str(e)
         })
+    
+    finally:
+        hook_counted_bytes.pop(download_id, None)
+        bandwidth.unregister(download_id)
+        if not handed_off:
+            storage.release(download_id)
+            if cache_key:
+                download_cache.release(cache_key, download_id)
 
-@app.route('/progress/<download_id>', methods=['GET'])
-def get_progress(download_id):
-    if download_id not in download_progress:
-        return jsonify({'error': 'Download não encontrado'}), 404
+# ======================================================================
+
+# Pós-processamento com ffmpeg: merge de vídeo + áudio, remux e extração de áudio
+
+AUDIO_TARGETS = ('mp3', 'm4a')
+CONVERT_TARGETS = AUDIO_TARGETS + ('mp4', 'mkv')
+
+# Codecs que cada contêiner aceita por cópia direta (None: qualquer um)
+CONTAINER_CODECS = {
+    'mp4': ('avc1', 'h264', 'hev1', 'hvc1', 'av01', 'vp09', 'vp9', 'mp4a', 'aac', 'opus', 'mp3'),
+    'webm': ('vp8', 'vp9', 'vp09', 'av01', 'opus', 'vorbis'),
+    'm4a': ('mp4a', 'aac'),
+    'mp3': ('mp3',),
+    'mkv': None
+}
+# Codificadores usados quando a cópia não é possível
+VIDEO_ENCODERS = {'mp4': ['libx264', '-preset', 'veryfast'], 'webm': ['libvpx-vp9']}
+AUDIO_ENCODERS = {'mp4': ['aac', '-b:a', '192k'], 'm4a': ['aac', '-b:a', '192k'],
+                  'mp3': ['libmp3lame', '-q:a', '2'], 'webm': ['libopus']}
+MUXERS = {'mkv': 'matroska', 'm4a': 'ipod'}
+
+def plan_postprocess(info, format_id=None, convert=None):
+    """Return (formats to download, output container or None).
+    
+    A "video+audio" format_id is merged, a video-only format gets the best
+    audio track and convert extracts audio (mp3/m4a) or remuxes (mp4/mkv).
+    Without ffmpeg, single formats are delivered as they are.
+    """
+    if format_id and '+' in format_id:
+        parts = [info.by_id.get(part) for part in format_id.split('+')]
+        if len(parts) != 2 or None in parts:
+            raise ValueError(f"Formato inválido: {format_id}")
+    else:
+        fmt = info.select(format_id)
+        if convert in AUDIO_TARGETS and (fmt is None or fmt.has_video):
+            fmt = info.best_audio(convert) or fmt
+        parts = [fmt]
+        if fmt is not None and fmt.has_video and not fmt.has_audio and convert not in AUDIO_TARGETS:
+            audio = info.best_audio('m4a' if fmt.ext == 'mp4' else fmt.ext)
+            if audio is not None and FFMPEG_PATH:
+                parts.append(audio)
+    
+    if not FFMPEG_PATH:
+        if convert or len(parts) > 1:
+            raise RuntimeError('Conversão indisponível: FFmpeg não encontrado')
+        return parts, None
+    if convert:
+        if parts[0] is None:
+            raise ValueError('Formato indisponível para conversão')
+        return parts, convert
+    if len(parts) > 1:
+        target = parts[0].ext if parts[0].ext in ('mp4', 'webm') else 'mkv'
+        if not all(codecs_fit(target, fmt) for fmt in parts):
+            target = 'mkv'  # aceita qualquer combinação sem recodificar
+        return parts, target
+    return parts, None
+
+def check_convert(convert):
+    """Error message for an unsupported convert option, or None"""
+    if convert is None:
+        return None
+    if convert not in CONVERT_TARGETS:
+        return f"Conversão inválida, use: {', '.join(CONVERT_TARGETS)}"
+    if not FFMPEG_PATH:
+        return 'Conversão indisponível: FFmpeg não encontrado'
+    return None
+
+def codec_fits(target, codec):
+    allowed = CONTAINER_CODECS[target]
+    return allowed is None or (codec or '').split('.')[0] in allowed
+
+def codecs_fit(target, fmt):
+    return ((not fmt.has_video or codec_fits(target, fmt.vcodec))
+            and (not fmt.has_audio or codec_fits(target, fmt.acodec)))
+
+def ffmpeg_command(inputs, parts, output, target, copy=True):
+    """ffmpeg arguments; streams whose codec fits target are copied, not transcoded"""
+    command = [FFMPEG_PATH, '-y', '-nostdin', '-loglevel', 'error', '-nostats', '-progress', 'pipe:1']
+    for path in inputs:
+        command += ['-i', path]
+    
+    video = next((i for i, fmt in enumerate(parts) if fmt and fmt.has_video), None)
+    audio = next((i for i, fmt in enumerate(parts) if fmt and fmt.has_audio), None)
+    if target in AUDIO_TARGETS:
+        video = None
+    if video is not None:
+        command += ['-map', f'{video}:v:0', '-c:v']
+        if copy and codec_fits(target, parts[video].vcodec):
+            command.append('copy')
+        else:
+            command += VIDEO_ENCODERS.get(target, VIDEO_ENCODERS['mp4'])
+    else:
+        command.append('-vn')
+    if audio is not None:
+        command += ['-map', f'{audio}:a:0', '-c:a']
+        if copy and codec_fits(target, parts[audio].acodec):
+            command.append('copy')
+        else:
+            command += AUDIO_ENCODERS.get(target, AUDIO_ENCODERS['mp4'])
+    return command + ['-f', MUXERS.get(target, target), output]
+
+def run_ffmpeg(command, download_id, duration):
+    """Run ffmpeg, reporting its -progress output to /progress"""
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    stderr = []
+    # Ler o stderr em outra thread para o pipe não encher e travar o ffmpeg
+    reader = threading.Thread(target=lambda: stderr.extend(process.stderr), daemon=True)
+    reader.start()
+    for line in process.stdout:
+        key, _, value = line.strip().partition('=')
+        # out_time_ms também é informado em microssegundos
+        if key in ('out_time_us', 'out_time_ms') and value.isdigit() and duration:
+            if progress_store.due(download_id):
+                progress_store.update(download_id, {
+                    'percent': min(99, int(int(value) / (duration * 1e6) * 100))
+                })
+    process.wait()
+    reader.join()
+    if process.returncode != 0:
+        raise RuntimeError(f"ffmpeg falhou ({process.returncode}): {''.join(stderr).strip()[-500:]}")
+
+def run_postprocess(download_id, info, parts, inputs, target, cache_key):
+    """Post-processing job: runs ffmpeg over the downloaded parts and
+    completes the download. Stream copy is tried first; the transcoding
+    command only runs when it fails.
+    """
+    title = info.title or 'video'
+    tag = '-'.join(fmt.format_id for fmt in parts)
+    filename = f"{sanitize_filename(title)}.{target}"
+    output = os.path.join(storage.shard_dir(info.id), f"{sanitize_filename(title)}_{info.id}_{tag}.{target}")
+    storage.track(output, download_id)
+    
+    try:
+        progress_store.update(download_id, {
+            'status': 'processing',
+            'phase': 'postprocess',
+            'title': 'Convertendo com FFmpeg...' if target in AUDIO_TARGETS else 'Juntando vídeo e áudio...'
+        })
+        started = time.time()
+        command = ffmpeg_command(inputs, parts, output, target)
+        mode = 'copy' if 'copy' in command else 'transcode'
+        try:
+            run_ffmpeg(command, download_id, info.duration)
+        except RuntimeError as e:
+            fallback = ffmpeg_command(inputs, parts, output, target, copy=False)
+            if fallback == command:
+                raise
+            # O codec informado pelo yt-dlp não bateu com o arquivo: recodificar
+            app.logger.warning(f"Stream copy failed for {download_id}, transcoding: {str(e)}")
+            mode = 'transcode'
+            run_ffmpeg(fallback, download_id, info.duration)
+        POSTPROCESS_SECONDS.observe(time.time() - started, mode)
+        
+        for path in inputs:
+            storage.discard(path)
+        download_cache.put(cache_key, output, filename)
+        progress_store.update(download_id, {
+            'status': 'completed',
+            'phase': None,
+            'percent': 100,
+            'title': title,
+            'filepath': output,
+            'filename': filename
+        })
+    
+    except Exception as e:
+        app.logger.error(f"Post-processing error: {str(e)}")
+        storage.discard(output)
+        progress_store.update(download_id, {
+            'status': 'error',
+            'error': str(e)
+        })
+    
+    finally:
+        storage.release(download_id)
+        download_cache.release(cache_key, download_id)
+
+# ======================================================================
+
+# Streaming direto: repassa os bytes ao cliente enquanto são baixados
+
+@app.route('/stream', methods=['GET'])
+def stream_video():
+    url = request.args.get('url', '').strip()
+    format_id = request.args.get('format_id', '').strip()
+    tee = request.args.get('cache', '1') != '0'
+    
+    if not url:
+        return jsonify({'error': 'URL não fornecida'}), 400
+    parsed = parse_video_url(url)
+    if parsed is None:
+        return jsonify({'error': 'URL do YouTube inválida'}), 400
+    
+    try:
+        info = get_video_info(parsed.canonical)
+    except Exception as e:
+        app.logger.error(f"Error checking video: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+    
+    fmt = info.select(format_id)
+    if fmt is None or fmt.protocol not in ('http', 'https'):
+        return jsonify({'error': 'Formato indisponível para streaming, use /download'}), 400
+    
+    filepath, download_name = direct_download_path(info, fmt)
+    content_disposition = f"attachment; filename*=UTF-8''{quote(download_name)}"
+    
+    # Já está no cache: servir o arquivo (com suporte a Range)
+    cache_key = download_cache.key(info.id, fmt.format_id)
+    entry = download_cache.get(cache_key)
+    if entry:
+        return send_file(os.path.abspath(entry['filepath']), as_attachment=True,
+                         download_name=entry['filename'], conditional=True)
+    
+    headers = format_headers(fmt)
+    client_range = request.headers.get('Range')
+    if client_range:
+        headers['Range'] = client_range
+        tee = False  # respostas parciais não são guardadas no cache
+    
+    try:
+        upstream = download_session.get(fmt.url, headers=headers, stream=True, timeout=30)
+        upstream.raise_for_status()
+    except requests.exceptions.RequestException as e:
+        app.logger.error(f"Stream request failed: {str(e)}")
+        return jsonify({'error': str(e)}), 502
     
-    progress_data = download_progress[download_id]
+    # Só grava no cache se houver espaço e nenhum outro processo estiver gravando o arquivo
+    stream_id = f"stream-{uuid.uuid4()}"
+    bandwidth.register(stream_id, weight=2)  # há um cliente esperando cada bloco
+    expected_size = int(upstream.headers.get('content-length', 0))
+    if tee and (not make_storage_room(expected_size) or not download_cache.claim_tee(cache_key, stream_id)):
+        tee = False
+    
+    def generate():
+        # O gerador só lê do servidor de origem quando o cliente consome o bloco
+        # anterior, então um cliente lento não acumula dados na memória
+        tmp_path = f"{filepath}.{stream_id}.part"
+        written = 0
+        completed = False
+        if tee:
+            storage.track(tmp_path, stream_id)
+        try:
+            with upstream, (open(tmp_path, 'wb') if tee else contextlib.nullcontext()) as f:
+                for chunk in upstream.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    if not chunk:
+                        continue
+                    if f:
+                        f.write(chunk)
+                    written += len(chunk)
+                    count_downloaded('stream', len(chunk))
+                    bandwidth.consume(stream_id, len(chunk))
+                    yield chunk
+            completed = True
+        finally:
+            if tee:
+                if completed and written and (not expected_size or written == expected_size):
+                    os.replace(tmp_path, filepath)
+                    download_cache.put(cache_key, filepath, download_name)
+                else:
+                    storage.discard(tmp_path)
+    
+    def close():
+        # Também chamado quando o cliente desiste antes do primeiro bloco
+        upstream.close()
+        bandwidth.unregister(stream_id)
+        if tee:
+            download_cache.release_tee(cache_key, stream_id)
+            storage.release(stream_id)
+    
+    response_headers = {'Content-Disposition': content_disposition, 'X-Accel-Buffering': 'no'}
+    for name in ('Content-Length', 'Content-Range', 'Accept-Ranges'):
+        if name in upstream.headers:
+            response_headers[name] = upstream.headers[name]
+    response = Response(generate(), status=upstream.status_code, headers=response_headers,
+                        mimetype=upstream.headers.get('Content-Type', 'application/octet-stream'))
+    response.call_on_close(close)
+    return response
+
+def progress_payload(download_id):
+    """JSON payload served by /progress for download_id, or None"""
+    progress_data = resolve_progress(download_id)
+    if progress_data is None:
+        return None
+    if progress_data.get('type') == 'batch':
+        return batch_payload(download_id, progress_data)
+    progress_data = dict(progress_data)
+    
+    # Enquanto estiver na fila, informar a posição atual
+    if progress_data.get('status') == 'queued':
+        # A entrada pode ter expirado desde a leitura acima; progress_leader aceita isso
+        position = scheduler.position(progress_leader(download_id))
+        if position is not None:
+            progress_data['queue_position'] = position
     
     # Se o download estiver concluído, fornecer URL para download
     if progress_data.get('status') == 'completed':
         download_url = url_for('get_file', download_id=download_id)
         progress_data['download_url'] = download_url
     
+    return progress_data
+
+@app.route('/progress/<download_id>', methods=['GET'])
+def get_progress(download_id):
+    PROGRESS_REQUESTS.inc('poll')
+    progress_data = progress_payload(download_id)
+    if progress_data is None:
+        return jsonify({'error': 'Download não encontrado'}), 404
+    
     return jsonify(progress_data)
 
+@app.route('/progress/<download_id>/stream', methods=['GET'])
+def stream_progress(download_id):
+    PROGRESS_REQUESTS.inc('stream')
+    progress_data = progress_store.get(download_id)
+    if progress_data is None:
+        return jsonify({'error': 'Download não encontrado'}), 404
+    
+    # O progresso de um lote vem dos downloads filhos, que não notificam o lote
+    wait_timeout = PROGRESS_STREAM_INTERVAL if progress_data.get('type') == 'batch' else PROGRESS_KEEPALIVE
+    
+    # Sem thread livre para mais um stream: o EventSource recebe o erro e a página volta ao polling
+    if not progress_streams.acquire(blocking=False):
+        return jsonify({'error': 'Muitas conexões de progresso, use /progress'}), 503
+    
+    def generate():
+        last_data = None
+        last_sent = time.monotonic()
+        while True:
+            # Downloads deduplicados recebem as atualizações do download original, que pode
+            # mudar enquanto o formato é resolvido
+            cond = progress_store.condition(progress_leader(download_id))
+            with cond:
+                data = progress_payload(download_id)
+                if data == last_data:
+                    # Sem mudanças: esperar a próxima atualização
+                    progress_store.wait(cond, wait_timeout)
+                    data = progress_payload(download_id)
+            if data is None:
+                break
+            if data == last_data:
+                if time.monotonic() - last_sent >= PROGRESS_KEEPALIVE:
+                    yield ": keep-alive\n\n"
+                    last_sent = time.monotonic()
+                continue
+            yield f"data: {json.dumps(data)}\n\n"
+            last_data = data
+            last_sent = time.monotonic()
+            if data.get('status') in ('completed', 'error'):
+                break
+            # Limitar a taxa de eventos; atualizações intermediárias são agrupadas
+            time.sleep(PROGRESS_STREAM_INTERVAL)
+    
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    response.call_on_close(progress_streams.release)
+    return response
+
 @app.route('/file/<download_id>', methods=['GET'])
 def get_file(download_id):
-    if download_id not in download_progress:
+    progress_data = resolve_progress(download_id)
+    if progress_data is None:
         return jsonify({'error': 'Download não encontrado'}), 404
     
-    progress_data = download_progress[download_id]
-    
     if progress_data.get('status') != 'completed':
         return jsonify({'error': 'Download ainda não concluído'}), 400
     
@@ -524,13 +2964,37 @@ def get_file(download_id):
     
     if not filepath or not os.path.exists(filepath):
         return jsonify({'error': 'Arquivo não encontrado'}), 404
+    bandwidth.serving(os.path.getsize(filepath))
+    
+    # Delegar a transferência ao proxy (nginx) quando configurado
+    if FILE_SERVING_MODE == 'x-accel':
+        relative_path = os.path.relpath(os.path.abspath(filepath), os.path.abspath(DOWNLOAD_FOLDER))
+        response = Response(mimetype='application/octet-stream')
+        response.headers['X-Accel-Redirect'] = X_ACCEL_PREFIX.rstrip('/') + '/' + quote(relative_path.replace(os.sep, '/'))
+        response.headers['Content-Disposition'] = f"attachment; filename*=UTF-8''{quote(filename)}"
+        return response
     
-    # Enviar o arquivo para o usuário
-    return send_file(
-        filepath,
-        as_attachment=True,
-        download_name=filename
-    )
+    # Enviar o arquivo para o usuário. Range/206, ETag e If-Modified-Since são
+    # tratados pelo send_file; sem Range, o servidor WSGI pode usar sendfile()
+    # (wsgi.file_wrapper) e, no modo x-sendfile, o proxy envia o arquivo.
+    # O span mede stat/ETag/abertura; a transferência acontece depois, no servidor
+    with span('send_file'):
+        return send_file(
+            os.path.abspath(filepath),
+            as_attachment=True,
+            download_name=filename,
+            conditional=True,
+            etag=True,
+            max_age=FILE_MAX_AGE
+        )
+
+def channel_list_response(items):
+    """Wrap channel items in the shape of a channels.list API response"""
+    return {
+        'kind': 'youtube#channelListResponse',
+        'pageInfo': {'totalResults': len(items), 'resultsPerPage': len(items)},
+        'items': items
+    }
 
 @app.route('/channel/<channel_id>', methods=['GET'])
 def get_channel_info(channel_id):
@@ -538,21 +3002,67 @@ def get_channel_info(channel_id):
         return jsonify({"error": "YouTube API key not configured or not set in environment variables"}), 500
     
     try:
-        response = requests.get(
-            "https://www.googleapis.com/youtube/v3/channels",
-            params={
-                "part": "snippet,statistics",
-                "id": channel_id,
-                "key": YOUTUBE_API_KEY
-            },
-            timeout=10
-        )
-        response.raise_for_status()
-        return jsonify(response.json())
-    except requests.exceptions.RequestException as e:
+        channels = channel_client.get_many([channel_id])
+        return jsonify(channel_list_response([channels[channel_id]] if channels[channel_id] else []))
+    except (requests.exceptions.RequestException, FutureTimeoutError) as e:
+        app.logger.error(f"API request failed: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/channels', methods=['GET'])
+def get_channels_info():
+    if not YOUTUBE_API_KEY: 
+        return jsonify({"error": "YouTube API key not configured or not set in environment variables"}), 500
+    
+    ids = [channel_id.strip() for channel_id in request.args.get('ids', '').split(',') if channel_id.strip()]
+    if not ids:
+        return jsonify({'error': 'Nenhum ID de canal fornecido'}), 400
+    
+    try:
+        channels = channel_client.get_many(ids)
+        return jsonify(channel_list_response([channels[channel_id] for channel_id in dict.fromkeys(ids)
+                                              if channels[channel_id]]))
+    except (requests.exceptions.RequestException, FutureTimeoutError) as e:
         app.logger.error(f"API request failed: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
+metrics.gauge('ytdl_jobs_active', 'Downloads running in the worker pool',
+              lambda: scheduler.stats()['active'])
+metrics.gauge('ytdl_jobs_queued', 'Downloads waiting in the queue', lambda: scheduler.stats()['queued'])
+metrics.gauge('ytdl_jobs_workers', 'Size of the download worker pool', lambda: scheduler.workers)
+metrics.gauge('ytdl_download_bytes_per_second', 'Origin throughput over the last 10 seconds',
+              download_rate.rate)
+metrics.gauge('ytdl_download_folder_bytes', 'Size of the indexed files in DOWNLOAD_FOLDER',
+              lambda: storage.stats()['used'])
+metrics.gauge('ytdl_download_folder_files', 'Number of indexed files in DOWNLOAD_FOLDER',
+              lambda: storage.stats()['files'])
+metrics.gauge('ytdl_storage_reserved_bytes', 'Bytes reserved by running downloads',
+              lambda: storage.stats()['reserved'])
+metrics.gauge('ytdl_storage_quota_bytes', 'STORAGE_MAX_BYTES', lambda: storage.max_bytes)
+metrics.gauge('ytdl_disk_free_bytes', 'Free space on the DOWNLOAD_FOLDER filesystem',
+              lambda: shutil.disk_usage(DOWNLOAD_FOLDER).free)
+metrics.gauge('ytdl_download_cache_bytes', 'Bytes held by the download cache',
+              lambda: download_cache.stats()['bytes'])
+metrics.gauge('ytdl_ydl_instances_created_total', 'YoutubeDL instances created by the pool',
+              lambda: ydl_pool.stats()['created'], kind='counter')
+metrics.gauge('ytdl_info_cache_hits_total', 'extract_info cache hits', lambda: info_cache.stats()['hits'],
+              kind='counter')
+metrics.gauge('ytdl_info_cache_misses_total', 'extract_info cache misses', lambda: info_cache.stats()['misses'],
+              kind='counter')
+metrics.gauge('ytdl_startup_seconds', 'Process startup phases: import, yt-dlp import, first request',
+              lambda: {(phase,): round(seconds, 4) for phase, seconds in startup_times.items()},
+              labels=('phase',))
+metrics.gauge('ytdl_bandwidth_jobs', 'Jobs sharing the ingress bandwidth', lambda: bandwidth.stats()['jobs'])
+metrics.gauge('ytdl_method_success_rate', 'Weighted success rate of each download method',
+              lambda: {(method,): round(h['success_rate'], 3) for method, h in fallback_engine.snapshot().items()},
+              labels=('method',))
+metrics.gauge('ytdl_method_circuit_open', 'Whether the circuit breaker of a download method is open',
+              lambda: {(method,): int(h['open']) for method, h in fallback_engine.snapshot().items()},
+              labels=('method',))
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 @app.errorhandler(404)
 def page_not_found(e):
     return render_template('404.html'), 404
@@ -561,14 +3071,16 @@ def page_not_found(e):
 def internal_server_error(e):
     return render_template('500.html'), 500
 
+startup_times['import'] = time.perf_counter() - IMPORT_STARTED
+
 if __name__ == '__main__':
-    # Clean up old downloads on startup
-    for filename in os.listdir(DOWNLOAD_FOLDER):
-        filepath = os.path.join(DOWNLOAD_FOLDER, filename)
-        try:
-            if os.path.isfile(filepath) and allowed_file(filename):
-                os.unlink(filepath)
-        except Exception as e:
-            app.logger.error(f"Error deleting file {filepath}: {str(e)}")
+    debug = os.getenv('FLASK_DEBUG', '1') == '1'
+    create_app()
+    
+    # Warm-up do yt-dlp e janitor (que também aplica a política do cache) em
+    # segundo plano. O reloader do modo debug também executa este bloco no
+    # processo pai, que não atende pedidos
+    if not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_background_tasks()
     
-    app.run(debug=True, host='0.0.0.0', port=5000)
+    app.run(debug=debug, host='0.0.0.0', port=5000)
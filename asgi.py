@@ -0,0 +1,196 @@
+# Modo de execução assíncrono (ASGI)
+#
+#     uvicorn asgi:application
+#
+# Um único worker: com mais de um (--workers), /progress e /file só funcionam
+# com PROGRESS_BACKEND=sqlite:///... (veja gunicorn.conf.py).
+#
+# /check-video, /channel/<channel_id>, /channels e /progress são atendidos aqui com
+# asyncio: chamadas bloqueantes do yt-dlp vão para um executor limitado e as
+# consultas à API do YouTube aguardam os Futures do ChannelClient, sem ocupar
+# threads. As demais rotas continuam no Flask, através do adaptador WSGI do
+# asgiref.
+
+import asyncio
+import json
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+import requests
+from asgiref.wsgi import WsgiToAsgi
+
+from app import (create_app, channel_client, channel_list_response, check_video_result,
+                 progress_payload, progress_store, YOUTUBE_API_KEY, PROGRESS_STREAM_INTERVAL,
+                 PROGRESS_KEEPALIVE, PROGRESS_REQUESTS, start_background_tasks)
+
+ASYNC_EXECUTOR_WORKERS = int(os.getenv('ASYNC_EXECUTOR_WORKERS', 8))
+
+flask_app = create_app()
+executor = ThreadPoolExecutor(max_workers=ASYNC_EXECUTOR_WORKERS, thread_name_prefix='asgi-blocking')
+wsgi_application = WsgiToAsgi(flask_app)
+
+async def run_blocking(func, *args):
+    return await asyncio.get_running_loop().run_in_executor(executor, func, *args)
+
+async def send_json(send, payload, status=200):
+    body = json.dumps(payload).encode()
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())]
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+async def read_body(receive):
+    body = b''
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            return body
+
+def with_request_context(func, *args):
+    # progress_payload usa url_for, que precisa de um contexto do Flask
+    with flask_app.test_request_context():
+        return func(*args)
+
+async def check_video(scope, receive, send):
+    form = parse_qs((await read_body(receive)).decode())
+    url = form.get('url', [''])[0].strip()
+    payload, status = await run_blocking(check_video_result, url)
+    await send_json(send, payload, status)
+
+async def get_channels(ids):
+    # O ChannelClient devolve Futures: aguardá-los não ocupa nenhuma thread
+    futures = channel_client.get_futures(ids)
+    return {channel_id: await asyncio.wrap_future(future) for channel_id, future in futures.items()}
+
+async def get_channel_info(scope, receive, send, channel_id):
+    if not YOUTUBE_API_KEY:
+        await send_json(send, {"error": "YouTube API key not configured or not set in environment variables"}, 500)
+        return
+    
+    try:
+        channels = await asyncio.wait_for(get_channels([channel_id]), timeout=30)
+    except (requests.exceptions.RequestException, asyncio.TimeoutError) as e:
+        flask_app.logger.error(f"API request failed: {str(e)}")
+        await send_json(send, {"error": str(e)}, 500)
+        return
+    await send_json(send, channel_list_response([channels[channel_id]] if channels[channel_id] else []))
+
+async def get_channels_info(scope, receive, send):
+    if not YOUTUBE_API_KEY:
+        await send_json(send, {"error": "YouTube API key not configured or not set in environment variables"}, 500)
+        return
+    
+    query = parse_qs(scope['query_string'].decode())
+    ids = [channel_id.strip() for channel_id in query.get('ids', [''])[0].split(',') if channel_id.strip()]
+    if not ids:
+        await send_json(send, {'error': 'Nenhum ID de canal fornecido'}, 400)
+        return
+    
+    try:
+        channels = await asyncio.wait_for(get_channels(ids), timeout=30)
+    except (requests.exceptions.RequestException, asyncio.TimeoutError) as e:
+        flask_app.logger.error(f"API request failed: {str(e)}")
+        await send_json(send, {"error": str(e)}, 500)
+        return
+    await send_json(send, channel_list_response([channels[channel_id] for channel_id in dict.fromkeys(ids)
+                                                 if channels[channel_id]]))
+
+async def get_progress(scope, receive, send, download_id):
+    PROGRESS_REQUESTS.inc('poll')
+    # Com PROGRESS_BACKEND=sqlite a leitura é I/O de disco: fora do event loop
+    payload = await run_blocking(with_request_context, progress_payload, download_id)
+    if payload is None:
+        await send_json(send, {'error': 'Download não encontrado'}, 404)
+        return
+    await send_json(send, payload)
+
+async def stream_progress(scope, receive, send, download_id):
+    PROGRESS_REQUESTS.inc('stream')
+    if await run_blocking(progress_store.get, download_id) is None:
+        await send_json(send, {'error': 'Download não encontrado'}, 404)
+        return
+    
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': [(b'content-type', b'text/event-stream'), (b'cache-control', b'no-cache'),
+                    (b'x-accel-buffering', b'no')]
+    })
+    
+    # O send() não avisa quando o cliente some: só o receive() traz o http.disconnect
+    disconnected = asyncio.Event()
+    
+    async def watch_disconnect():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+        disconnected.set()
+    
+    watcher = asyncio.ensure_future(watch_disconnect())
+    
+    # Cada cliente custa apenas uma corrotina; o estado é lido a cada intervalo
+    last_data = None
+    last_sent = time.monotonic()
+    try:
+        while not disconnected.is_set():
+            data = await run_blocking(with_request_context, progress_payload, download_id)
+            if data is None:
+                break
+            if data != last_data:
+                chunk = f"data: {json.dumps(data)}\n\n"
+                last_data = data
+            elif time.monotonic() - last_sent >= PROGRESS_KEEPALIVE:
+                chunk = ": keep-alive\n\n"
+            else:
+                chunk = None
+            if chunk:
+                await send({'type': 'http.response.body', 'body': chunk.encode(), 'more_body': True})
+                last_sent = time.monotonic()
+            if data.get('status') in ('completed', 'error'):
+                break
+            try:
+                await asyncio.wait_for(disconnected.wait(), PROGRESS_STREAM_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        watcher.cancel()
+    if not disconnected.is_set():
+        await send({'type': 'http.response.body', 'body': b''})
+
+ROUTES = [
+    ('POST', re.compile(r'^/check-video$'), check_video),
+    ('GET', re.compile(r'^/channel/([^/]+)$'), get_channel_info),
+    ('GET', re.compile(r'^/channels$'), get_channels_info),
+    ('GET', re.compile(r'^/progress/([^/]+)$'), get_progress),
+    ('GET', re.compile(r'^/progress/([^/]+)/stream$'), stream_progress),
+]
+
+async def lifespan(scope, receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            start_background_tasks()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            executor.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await lifespan(scope, receive, send)
+        return
+    
+    if scope['type'] == 'http':
+        for method, pattern, handler in ROUTES:
+            match = pattern.match(scope['path'])
+            if match and scope['method'] == method:
+                await handler(scope, receive, send, *match.groups())
+                return
+    
+    await wsgi_application(scope, receive, send)
@@ -0,0 +1,93 @@
+# Servidor HTTP local que imita o CDN do YouTube para os benchmarks
+#
+#     python bench/fake_cdn.py --port 8900 --bandwidth-mbps 50 --latency-ms 20
+#
+# GET /video/<video_id>.mp4?size=<bytes> devolve bytes sintéticos, com suporte a
+# Range, limitando a banda por conexão e adicionando latência antes da resposta.
+
+import argparse
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+PATTERN = bytes(range(256)) * 256  # 64 KB repetidos para montar o corpo
+
+def synthetic_bytes(start, length):
+    """Deterministic content of a synthetic video between start and start+length"""
+    offset = start % len(PATTERN)
+    data = PATTERN[offset:] + PATTERN * (length // len(PATTERN) + 1)
+    return data[:length]
+
+class FakeCDNHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    bandwidth = 0  # bytes/s por conexão (0 = sem limite)
+    latency = 0.0
+    chunk_size = 64 * 1024
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        parsed = urlparse(self.path)
+        match = re.match(r'^/video/([\w-]+)\.mp4$', parsed.path)
+        if not match:
+            self.send_error(404)
+            return
+        size = int(parse_qs(parsed.query).get('size', ['1048576'])[0])
+        
+        if self.latency:
+            time.sleep(self.latency)
+        
+        start, end = 0, size - 1
+        range_header = self.headers.get('Range')
+        if range_header:
+            range_match = re.match(r'bytes=(\d+)-(\d*)', range_header)
+            start = int(range_match.group(1))
+            end = min(int(range_match.group(2) or end), size - 1)
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        else:
+            self.send_response(200)
+        self.send_header('Content-Type', 'video/mp4')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('ETag', f'"{match.group(1)}-{size}"')
+        self.end_headers()
+        
+        position = start
+        started = time.monotonic()
+        try:
+            while position <= end:
+                length = min(self.chunk_size, end + 1 - position)
+                self.wfile.write(synthetic_bytes(position, length))
+                position += length
+                if self.bandwidth:
+                    # Limitar a banda: dormir até o tempo "devido" para os bytes enviados
+                    delay = (position - start) / self.bandwidth - (time.monotonic() - started)
+                    if delay > 0:
+                        time.sleep(delay)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+def start_fake_cdn(port=0, bandwidth_mbps=0, latency_ms=0):
+    """Start the fake CDN in a background thread and return its server"""
+    handler = type('ConfiguredFakeCDNHandler', (FakeCDNHandler,), {
+        'bandwidth': bandwidth_mbps * 1024 * 1024 / 8,
+        'latency': latency_ms / 1000
+    })
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True, name='fake-cdn').start()
+    return server
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Fake YouTube/CDN server for benchmarks')
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--bandwidth-mbps', type=float, default=0, help='limite por conexão (0 = sem limite)')
+    parser.add_argument('--latency-ms', type=float, default=0)
+    args = parser.parse_args()
+    server = start_fake_cdn(args.port, args.bandwidth_mbps, args.latency_ms)
+    print(f"Fake CDN em http://127.0.0.1:{server.server_port}/video/<id>.mp4?size=<bytes>")
+    threading.Event().wait()
@@ -0,0 +1,215 @@
+# Benchmark / teste de carga do serviço de downloads
+#
+#     python bench/run.py --downloads 8 --pollers 2 --size-mb 16 --output results.json
+#
+# Sobe o app.py em um servidor WSGI local, com o yt-dlp substituído pelo
+# ytdlp_stub e os vídeos servidos pelo fake_cdn, e mede requisições/s,
+# latências p50/p99, MB/s de download e uso de memória (RSS). O resultado é
+# impresso (ou gravado) em JSON para acompanhar regressões.
+
+import argparse
+import hashlib
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from fake_cdn import start_fake_cdn  # noqa: E402
+import ytdlp_stub  # noqa: E402
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[index]
+
+def bench_video_id(*parts):
+    # IDs válidos (11 caracteres), diferentes a cada execução para não acertar o cache
+    return hashlib.sha1('-'.join(map(str, parts)).encode()).hexdigest()[:11]
+
+def latency_summary(latencies):
+    return {
+        'count': len(latencies),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2) if latencies else None,
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2) if latencies else None,
+        'mean_ms': round(statistics.mean(latencies) * 1000, 2) if latencies else None
+    }
+
+def memory_usage():
+    """Current and peak RSS of this process, in MB"""
+    usage = {}
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(('VmRSS:', 'VmHWM:')):
+                    name, value = line.split(':')
+                    usage['rss_mb' if name == 'VmRSS' else 'peak_rss_mb'] = round(int(value.split()[0]) / 1024, 1)
+    except OSError:
+        import resource
+        usage['peak_rss_mb'] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    return usage
+
+def start_app_server(app):
+    from werkzeug.serving import make_server
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True, name='bench-app').start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+def run_check_video(base_url, args, run_id):
+    """Concurrent /check-video calls; half of the URLs repeat (cache hits)"""
+    session = requests.Session()
+    latencies = []
+    lock = threading.Lock()
+    
+    def worker(index):
+        video_id = bench_video_id(run_id, 'cv', index % max(1, args.requests // 2))
+        started = time.perf_counter()
+        response = session.post(f"{base_url}/check-video", data={'url': f"https://www.youtube.com/watch?v={video_id}"})
+        elapsed = time.perf_counter() - started
+        response.raise_for_status()
+        with lock:
+            latencies.append(elapsed)
+    
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.clients) as executor:
+        list(executor.map(worker, range(args.requests)))
+    elapsed = time.perf_counter() - started
+    return dict(latency_summary(latencies), requests_per_second=round(len(latencies) / elapsed, 1))
+
+def run_downloads(base_url, args, run_id, format_id):
+    """N concurrent downloads with P pollers each on /progress"""
+    session = requests.Session()
+    download_ids = []
+    for index in range(args.downloads):
+        response = session.post(f"{base_url}/download", data={
+            'url': f"https://www.youtube.com/watch?v={bench_video_id(run_id, 'dl', format_id, index)}",
+            'format_id': format_id
+        })
+        response.raise_for_status()
+        download_ids.append(response.json()['download_id'])
+    
+    started = time.perf_counter()
+    poll_latencies = []
+    statuses = {}
+    lock = threading.Lock()
+    
+    def poller(download_id):
+        poll_session = requests.Session()
+        while True:
+            poll_started = time.perf_counter()
+            data = poll_session.get(f"{base_url}/progress/{download_id}").json()
+            with lock:
+                poll_latencies.append(time.perf_counter() - poll_started)
+            if data.get('status') in ('completed', 'error'):
+                with lock:
+                    statuses[download_id] = data.get('status')
+                return
+            time.sleep(args.poll_interval)
+    
+    with ThreadPoolExecutor(max_workers=args.downloads * args.pollers) as executor:
+        list(executor.map(poller, [d for d in download_ids for _ in range(args.pollers)]))
+    elapsed = time.perf_counter() - started
+    
+    completed = sum(status == 'completed' for status in statuses.values())
+    total_mb = completed * args.size_mb
+    return {
+        'downloads': args.downloads,
+        'completed': completed,
+        'elapsed_s': round(elapsed, 3),
+        'download_mb_per_s': round(total_mb / elapsed, 2),
+        'poll': dict(latency_summary(poll_latencies), requests_per_second=round(len(poll_latencies) / elapsed, 1)),
+        'memory': memory_usage()
+    }, download_ids
+
+def run_get_file(base_url, args, download_ids):
+    """Concurrent full downloads of finished files through /file"""
+    latencies = []
+    transferred = 0
+    lock = threading.Lock()
+    
+    def worker(download_id):
+        nonlocal transferred
+        started = time.perf_counter()
+        response = requests.get(f"{base_url}/file/{download_id}", stream=True)
+        size = sum(len(chunk) for chunk in response.iter_content(chunk_size=256 * 1024))
+        with lock:
+            latencies.append(time.perf_counter() - started)
+            transferred += size
+    
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.clients) as executor:
+        list(executor.map(worker, download_ids))
+    elapsed = time.perf_counter() - started
+    return dict(latency_summary(latencies), mb_per_s=round(transferred / 1024 / 1024 / elapsed, 2))
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the download service against local stand-ins')
+    parser.add_argument('--scenarios', default='check_video,download_requests,download_ytdlp,get_file')
+    parser.add_argument('--clients', type=int, default=16, help='clientes simultâneos para /check-video e /file')
+    parser.add_argument('--requests', type=int, default=200, help='chamadas a /check-video')
+    parser.add_argument('--downloads', type=int, default=8, help='downloads simultâneos')
+    parser.add_argument('--pollers', type=int, default=2, help='clientes consultando /progress por download')
+    parser.add_argument('--poll-interval', type=float, default=0.25)
+    parser.add_argument('--size-mb', type=float, default=16, help='tamanho de cada vídeo sintético')
+    parser.add_argument('--bandwidth-mbps', type=float, default=0, help='banda por conexão no CDN (0 = sem limite)')
+    parser.add_argument('--latency-ms', type=float, default=5, help='latência do CDN antes de responder')
+    parser.add_argument('--extract-latency-ms', type=float, default=50, help='custo simulado do extract_info')
+    parser.add_argument('--output', help='arquivo JSON de saída (padrão: stdout)')
+    args = parser.parse_args()
+    
+    # O app grava em ./downloads: usar um diretório temporário isolado
+    workdir = tempfile.mkdtemp(prefix='yt-bench-')
+    os.chdir(workdir)
+    import app as app_module
+    
+    cdn = start_fake_cdn(0, args.bandwidth_mbps, args.latency_ms)
+    ytdlp_stub.install(app_module, f"http://127.0.0.1:{cdn.server_port}", int(args.size_mb * 1024 * 1024),
+                       args.extract_latency_ms / 1000)
+    server, base_url = start_app_server(app_module.app)
+    
+    run_id = str(int(time.time()))
+    scenarios = args.scenarios.split(',')
+    results = {}
+    download_ids = []
+    if 'check_video' in scenarios:
+        results['check_video'] = run_check_video(base_url, args, run_id)
+    if 'download_requests' in scenarios:
+        results['download_requests'], ids = run_downloads(base_url, args, run_id, '18')
+        download_ids += ids
+    if 'download_ytdlp' in scenarios:
+        results['download_ytdlp'], ids = run_downloads(base_url, args, run_id, '22')
+        download_ids += ids
+    if 'get_file' in scenarios and download_ids:
+        results['get_file'] = run_get_file(base_url, args, download_ids)
+    
+    server.shutdown()
+    cdn.shutdown()
+    
+    report = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'config': vars(args),
+        'results': results,
+        'memory': memory_usage()
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    else:
+        print(output)
+
+if __name__ == '__main__':
+    main()
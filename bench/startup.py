@@ -0,0 +1,74 @@
+# Tempo de inicialização: import do app, create_app() e primeiro pedido
+#
+#     python bench/startup.py --runs 5
+#
+# Cada medição roda num processo novo (import a frio). "lazy" é o padrão do
+# servidor: o yt-dlp é importado pelo warm-up em segundo plano enquanto o
+# primeiro pedido já é atendido. "preload" é o que o mestre do gunicorn faz com
+# --preload: yt-dlp e o extrator do YouTube importados dentro do create_app().
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+
+def child(mode):
+    started = time.perf_counter()
+    sys.path[:0] = [ROOT_DIR, BENCH_DIR]
+    import app as app_module
+    imported = time.perf_counter()
+    flask_app = app_module.create_app(preload=mode == 'preload')
+    created = time.perf_counter()
+    if mode == 'lazy':
+        app_module.start_warm_up()
+
+    from run import start_app_server
+    import requests
+    server, base_url = start_app_server(flask_app)
+    request_started = time.perf_counter()
+    requests.get(f"{base_url}/metrics").raise_for_status()
+    first_response = time.perf_counter()
+
+    # Quando o yt-dlp fica pronto para o primeiro /check-video
+    while 'extractor_load' not in app_module.startup_times:
+        time.sleep(0.005)
+    ready = time.perf_counter()
+    server.shutdown()
+    print(json.dumps({
+        'import_s': imported - started,
+        'create_app_s': created - imported,
+        'first_request_ms': (first_response - request_started) * 1000,
+        'time_to_first_response_s': first_response - started,
+        'yt_dlp_ready_s': ready - started
+    }))
+
+def measure(mode, runs):
+    samples = []
+    for _ in range(runs):
+        # Diretório vazio a cada execução: o DOWNLOAD_FOLDER também começa a frio
+        with tempfile.TemporaryDirectory(prefix='ytdl-startup-') as workdir:
+            output = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', mode], cwd=workdir,
+                                    capture_output=True, text=True, check=True).stdout
+        samples.append(json.loads(output.strip().splitlines()[-1]))
+    return {key: round(statistics.median(sample[key] for sample in samples), 4) for key in samples[0]}
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure cold start of the app')
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--child', choices=('lazy', 'preload'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child)
+        return
+    print(json.dumps({mode: measure(mode, args.runs) for mode in ('lazy', 'preload')}, indent=2))
+
+if __name__ == '__main__':
+    main()
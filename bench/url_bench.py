@@ -0,0 +1,117 @@
+# Micro-benchmark e fuzzing do youtube_url.parse_youtube_url
+#
+#     python bench/url_bench.py                 # confere o corpus e mede ns/URL
+#     python bench/url_bench.py --fuzz 200000   # também gera mutações aleatórias
+#
+# O corpus (url_corpus.json) traz URLs reais e armadilhas com o resultado
+# esperado. O fuzzing muta essas URLs e verifica invariantes: nenhuma
+# exceção, IDs sempre válidos e a URL canônica relida dá o mesmo resultado.
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from youtube_url import parse_youtube_url, VIDEO_ID, PLAYLIST_ID  # noqa: E402
+
+CORPUS_FILE = os.path.join(BENCH_DIR, 'url_corpus.json')
+ALPHABET = 'abcXYZ019_-./:?&=#%@ \t' + 'vlistwatchyoutube'
+
+def legacy_video_id(url):
+    """The split-based parser that parse_youtube_url replaced, for comparison"""
+    video_id = None
+    if "youtube.com/watch" in url:
+        query_params = url.split("?")[1] if "?" in url else ""
+        for param in query_params.split("&"):
+            if param.startswith("v="):
+                video_id = param[2:]
+                break
+    elif "youtu.be/" in url:
+        video_id = url.split("youtu.be/")[1].split("?")[0].split("&")[0]
+    return video_id or None
+
+def check_corpus(corpus):
+    failures = 0
+    for case in corpus:
+        parsed = parse_youtube_url(case['url'])
+        got = (parsed.video_id, parsed.playlist_id) if parsed else (None, None)
+        if got != (case['video_id'], case['playlist_id']):
+            failures += 1
+            print(f"FAIL {case['url']!r}: esperado {(case['video_id'], case['playlist_id'])}, obtido {got}")
+    return failures
+
+def mutate(url, rng):
+    chars = list(url)
+    for _ in range(rng.randint(1, 4)):
+        operation = rng.random()
+        position = rng.randint(0, len(chars))
+        if operation < 0.4 and chars:
+            del chars[min(position, len(chars) - 1)]
+        elif operation < 0.8:
+            chars.insert(position, rng.choice(ALPHABET))
+        elif chars:
+            chars[min(position, len(chars) - 1)] = rng.choice(ALPHABET)
+    return ''.join(chars)
+
+def fuzz(corpus, iterations, seed):
+    rng = random.Random(seed)
+    urls = [case['url'] for case in corpus if case['url']]
+    failures = 0
+    for _ in range(iterations):
+        url = mutate(rng.choice(urls), rng)
+        try:
+            parsed = parse_youtube_url(url)
+            if parsed is None:
+                continue
+            assert parsed.video_id or parsed.playlist_id
+            assert parsed.video_id is None or VIDEO_ID.fullmatch(parsed.video_id)
+            assert parsed.playlist_id is None or PLAYLIST_ID.fullmatch(parsed.playlist_id)
+            # A URL canônica é estável
+            reparsed = parse_youtube_url(parsed.canonical)
+            assert reparsed is not None and reparsed.video_id == parsed.video_id
+        except Exception as e:
+            failures += 1
+            print(f"FUZZ FAIL {url!r}: {e!r}")
+    return failures
+
+def bench(func, urls, rounds):
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for url in urls:
+            func(url)
+    return (time.perf_counter() - started) / (rounds * len(urls)) * 1e9
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark and fuzz the YouTube URL parser')
+    parser.add_argument('--rounds', type=int, default=2000)
+    parser.add_argument('--fuzz', type=int, default=0, help='número de mutações aleatórias')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    with open(CORPUS_FILE, encoding='utf-8') as f:
+        corpus = json.load(f)
+
+    failures = check_corpus(corpus)
+    if args.fuzz:
+        failures += fuzz(corpus, args.fuzz, args.seed)
+
+    urls = [case['url'] for case in corpus]
+    valid = [case['url'] for case in corpus if case['video_id']]
+    invalid = [case['url'] for case in corpus if not case['video_id'] and not case['playlist_id']]
+    print(json.dumps({
+        'corpus': len(corpus),
+        'failures': failures,
+        'parse_ns': round(bench(parse_youtube_url, urls, args.rounds)),
+        'parse_valid_ns': round(bench(parse_youtube_url, valid, args.rounds)),
+        'reject_invalid_ns': round(bench(parse_youtube_url, invalid, args.rounds)),
+        'legacy_ns': round(bench(legacy_video_id, urls, args.rounds))
+    }, indent=2))
+    sys.exit(1 if failures else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+# Substituto do yt_dlp.YoutubeDL para os benchmarks
+#
+# Não acessa o YouTube: extract_info devolve formatos que apontam para o
+# fake_cdn e process_ie_result baixa o arquivo com requests, chamando os
+# progress_hooks como o yt-dlp faria.
+
+import os
+import re
+import time
+
+import requests
+
+class StubYoutubeDL:
+    cdn_url = 'http://127.0.0.1:8900'
+    video_size = 8 * 1024 * 1024
+    extract_latency = 0.0
+
+    def __init__(self, params=None):
+        self.params = params or {}
+        self.format_selector = self.params.get('format')
+        self._progress_hooks = list(self.params.get('progress_hooks', []))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def close(self):
+        pass
+
+    @staticmethod
+    def sanitize_info(info):
+        return info
+
+    def build_format_selector(self, format_spec):
+        return format_spec
+
+    def add_progress_hook(self, hook):
+        self._progress_hooks.append(hook)
+
+    def extract_info(self, url, download=True):
+        if self.extract_latency:
+            time.sleep(self.extract_latency)
+        match = re.search(r'(?:v=|youtu\.be/|shorts/)([\w-]{1,64})', url)
+        video_id = match.group(1) if match else 'video'
+        video_url = f"{self.cdn_url}/video/{video_id}.mp4?size={self.video_size}"
+        info = {
+            'id': video_id,
+            'title': f'Bench_{video_id}',
+            'thumbnail': '',
+            'duration': 60,
+            'webpage_url': url,
+            'extractor': 'youtube',
+            'extractor_key': 'Youtube',
+            'formats': [
+                # 18: arquivo único (caminho requests); 22: forçado pelo yt-dlp (stub)
+                {'format_id': '18', 'ext': 'mp4', 'height': 360, 'vcodec': 'avc1', 'acodec': 'mp4a',
+                 'protocol': 'https' if video_url.startswith('https') else 'http', 'url': video_url,
+                 'filesize': self.video_size},
+                {'format_id': '22', 'ext': 'mp4', 'height': 720, 'vcodec': 'avc1', 'acodec': 'mp4a',
+                 'protocol': 'm3u8_native', 'url': video_url, 'filesize': self.video_size},
+                # 137 + 140: vídeo e áudio separados (DASH), juntados pelo pós-processamento
+                {'format_id': '137', 'ext': 'mp4', 'height': 1080, 'vcodec': 'avc1.640028', 'acodec': 'none',
+                 'protocol': 'https' if video_url.startswith('https') else 'http', 'url': video_url,
+                 'filesize': self.video_size},
+                {'format_id': '140', 'ext': 'm4a', 'vcodec': 'none', 'acodec': 'mp4a.40.2',
+                 'protocol': 'https' if video_url.startswith('https') else 'http', 'url': video_url,
+                 'filesize': self.video_size // 8},
+            ]
+        }
+        if download:
+            return self.process_ie_result(info, download=True)
+        return info
+
+    def process_ie_result(self, info, download=True):
+        formats = {f['format_id']: f for f in info['formats']}
+        fmt = formats.get(self.format_selector) or info['formats'][-1]
+        info = dict(info, **fmt)
+        if not download:
+            return info
+        
+        outtmpl = self.params.get('outtmpl', '%(title)s_%(id)s.%(ext)s')
+        if isinstance(outtmpl, dict):
+            outtmpl = outtmpl.get('default')
+        filepath = render_outtmpl(outtmpl, info)
+        os.makedirs(os.path.dirname(filepath) or '.', exist_ok=True)
+        hooks = self._progress_hooks
+        
+        response = requests.get(fmt['url'], stream=True, timeout=30)
+        response.raise_for_status()
+        total = int(response.headers.get('content-length', 0))
+        downloaded = 0
+        started = time.time()
+        with response, open(filepath, 'wb') as f:
+            for chunk in response.iter_content(chunk_size=64 * 1024):
+                f.write(chunk)
+                downloaded += len(chunk)
+                elapsed = time.time() - started
+                for hook in hooks:
+                    hook({'status': 'downloading', 'downloaded_bytes': downloaded, 'total_bytes': total,
+                          'speed': downloaded / elapsed if elapsed else None, 'filename': filepath,
+                          'info_dict': info})
+        for hook in hooks:
+            hook({'status': 'finished', 'downloaded_bytes': downloaded, 'total_bytes': total,
+                  'filename': filepath, 'info_dict': info})
+        return dict(info, requested_downloads=[{'filepath': filepath}])
+
+def render_outtmpl(outtmpl, info):
+    # Subconjunto do template do yt-dlp: %(campo)s e %(campo.início:fim)s
+    def field(match):
+        value = str(info.get(match.group(1), 'NA'))
+        if match.group(2) is not None:
+            start, end = (int(n) if n else None for n in match.group(2).split(':'))
+            value = value[start:end]
+        return value
+    return re.sub(r'%\((\w+)(?:\.(\d*:\d*))?\)s', field, outtmpl)
+
+def install(app_module, cdn_url, video_size, extract_latency=0.0):
+    """Replace yt_dlp.YoutubeDL as seen by app.py with the stub"""
+    StubYoutubeDL.cdn_url = cdn_url
+    StubYoutubeDL.video_size = video_size
+    StubYoutubeDL.extract_latency = extract_latency
+    app_module.load_yt_dlp().YoutubeDL = StubYoutubeDL
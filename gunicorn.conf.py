@@ -0,0 +1,37 @@
+# Configuração do gunicorn para produção
+#
+#     pip install gunicorn
+#     gunicorn -c gunicorn.conf.py
+#
+# Com preload_app, o processo mestre importa o app, o yt-dlp e o extrator do
+# YouTube uma única vez (create_app(preload=True)) e os workers nascem por fork
+# já aquecidos, compartilhando esses módulos (copy-on-write). Threads não
+# sobrevivem ao fork: o warm-up do pool e o janitor começam em cada worker.
+#
+# O padrão é um worker. Com mais de um (WEB_CONCURRENCY), /progress, o SSE e
+# /file precisam de PROGRESS_BACKEND=sqlite:///...; sem isso o gunicorn não
+# inicia. Mesmo assim, o índice do cache de downloads, a deduplicação e a cota
+# do DOWNLOAD_FOLDER continuam por processo: cada worker só enxerga os arquivos
+# que ele mesmo baixou e aplica a cota sozinho.
+
+import os
+import sys
+
+bind = os.getenv('BIND', '0.0.0.0:5000')
+workers = int(os.getenv('WEB_CONCURRENCY', 1))
+worker_class = 'gthread'  # SSE (/progress/<id>/stream) e /stream ocupam uma thread cada
+threads = int(os.getenv('GUNICORN_THREADS', 16))
+timeout = 120
+preload_app = True
+wsgi_app = 'app:create_app(preload=True)'
+
+def on_starting(server):
+    from app import PROGRESS_BACKEND
+    if server.cfg.workers > 1 and PROGRESS_BACKEND == 'memory':
+        server.log.error('%d workers need a shared progress store: set PROGRESS_BACKEND=sqlite:///...',
+                         server.cfg.workers)
+        sys.exit(1)
+
+def post_fork(server, worker):
+    from app import start_background_tasks
+    start_background_tasks()
@@ -0,0 +1,85 @@
+# Normalização de URLs do YouTube
+#
+# Uma única expressão regular pré-compilada reconhece o host e o caminho
+# (watch, shorts, embed, live, youtu.be, playlist, m./music./nocookie) e a
+# query string é percorrida uma vez para achar v= e list=. URLs que não são
+# do YouTube são rejeitadas aqui, antes de qualquer chamada ao yt-dlp.
+
+import re
+from collections import namedtuple
+
+MAX_URL_LENGTH = 2048
+HOST_PREFIX_LENGTH = len('https://www.youtube-nocookie.com')
+
+VIDEO_ID = re.compile(r'[A-Za-z0-9_-]{11}')
+PLAYLIST_ID = re.compile(r'[A-Za-z0-9_-]{2,64}')
+
+URL_REGEX = r'''
+    ^\s*(?:https?:)?(?://)?
+    (?:
+        (?:(?:www|m|music)\.)?youtube\.com
+        (?::\d+)?
+        (?:
+            /(?:shorts|embed|live|v|e)/(?!videoseries)(?P<path_id>[A-Za-z0-9_-]{11})(?![A-Za-z0-9_-])
+          | /(?:watch|playlist|embed/videoseries)/?(?=[?#]|$)
+        )
+      | (?:www\.)?youtube-nocookie\.com(?::\d+)?/embed/
+        (?:(?!videoseries)(?P<embed_id>[A-Za-z0-9_-]{11})(?![A-Za-z0-9_-]) | videoseries/?(?=[?#]|$))
+      | (?:www\.)?youtu\.be(?::\d+)?/(?P<short_id>[A-Za-z0-9_-]{11})(?![A-Za-z0-9_-])
+    )
+    /?(?:\?(?P<query>[^#\s]*))?(?:\#[^\s]*)?\s*$
+'''
+URL_PATTERN = re.compile(URL_REGEX, re.VERBOSE)
+# IGNORECASE deixa o match bem mais lento: só é usado quando o host não está em minúsculas
+URL_PATTERN_NOCASE = re.compile(URL_REGEX, re.VERBOSE | re.IGNORECASE)
+
+QUERY_PARAM = re.compile(r'(?<![^&])(v|list)=([^&]*)')
+
+class YouTubeURL(namedtuple('YouTubeURL', ('video_id', 'playlist_id'))):
+    """Canonical identity of a YouTube URL (either field may be None)"""
+
+    __slots__ = ()
+
+    @property
+    def canonical(self):
+        """Canonical URL: the video when there is one, else the playlist"""
+        if self.video_id:
+            return f"https://www.youtube.com/watch?v={self.video_id}"
+        return f"https://www.youtube.com/playlist?list={self.playlist_id}"
+
+    @property
+    def playlist_url(self):
+        if self.playlist_id:
+            return f"https://www.youtube.com/playlist?list={self.playlist_id}"
+        return None
+
+def parse_youtube_url(url):
+    """Parse url into a YouTubeURL, or return None if it is not a YouTube
+    video or playlist URL.
+    """
+    if not url or len(url) > MAX_URL_LENGTH:
+        return None
+    match = URL_PATTERN.match(url)
+    if match is None:
+        # Só vale a pena repetir se o esquema/host tiver maiúsculas
+        head = url[:HOST_PREFIX_LENGTH]
+        if head == head.lower():
+            return None
+        match = URL_PATTERN_NOCASE.match(url)
+        if match is None:
+            return None
+
+    video_id = match.group('path_id') or match.group('embed_id') or match.group('short_id')
+    playlist_id = None
+    query = match.group('query')
+    if query:
+        for name, value in QUERY_PARAM.findall(query):
+            if name == 'v':
+                if video_id is None and VIDEO_ID.fullmatch(value):
+                    video_id = value
+            elif playlist_id is None and PLAYLIST_ID.fullmatch(value):
+                playlist_id = value
+
+    if video_id is None and playlist_id is None:
+        return None
+    return YouTubeURL(video_id, playlist_id)